@@ -1,21 +1,20 @@
 
-import json
-import os
+from pathlib import Path
 
-# スケジュールファイルの読み込み
-data_dir = os.path.join(os.getcwd(), "data")
-scheduled_file = os.path.join(data_dir, "scheduled.json")
+from src.storage import load_json, save_json
 
-if os.path.exists(scheduled_file):
-    with open(scheduled_file, "r", encoding="utf-8") as f:
-        data = json.load(f)
+# スケジュールファイルの読み込み（スクリプトの場所基準なので実行ディレクトリに依存しない）
+DATA_DIR = Path(__file__).resolve().parent / "data"
+scheduled_file = DATA_DIR / "scheduled.json"
+
+if scheduled_file.exists():
+    data = load_json(scheduled_file)
     
     # pending以外の投稿（postedなど）は残す
     new_data = [item for item in data if item["status"] != "pending"]
     old_pending_count = len(data) - len(new_data)
     
-    with open(scheduled_file, "w", encoding="utf-8") as f:
-        json.dump(new_data, f, ensure_ascii=False, indent=2)
+    save_json(scheduled_file, new_data)
 
     print(f"待機中のツイート {old_pending_count} 件を削除しました。")
 else:
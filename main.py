@@ -4,24 +4,24 @@ X自動運用システム - メインエントリポイント
 """
 
 import argparse
-import json
+import asyncio
 import logging
 import os
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
+from pathlib import Path
 
 from dotenv import load_dotenv
 
-load_dotenv()
+# データディレクトリ（実行時のカレントディレクトリに依存しない）
+DATA_DIR = Path(__file__).resolve().parent / "data"
 
-# ログ設定
+# ログ設定（ログファイルは引数の解析後、必要な場合だけ main() で追加する）
+_LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("x_auto.log", encoding="utf-8"),
-    ],
+    format=_LOG_FORMAT,
+    handlers=[logging.StreamHandler(sys.stdout)],
 )
 logger = logging.getLogger(__name__)
 
@@ -41,6 +41,7 @@ def setup_api_client():
 
 def run_style_analysis(api_client, auto=False):
     """過去ツイートのスタイル分析を実行"""
+    from src.storage import save_json
     from src.style_analyzer import StyleAnalyzer
 
     analyzer = StyleAnalyzer()
@@ -76,11 +77,9 @@ def run_style_analysis(api_client, auto=False):
     print(f"  平均文字数: {profile['avg_length']}")
     print(f"  主要語尾: {', '.join([e[0] for e in profile['endings'][:3]])}")
 
-    # 過去ツイートをキャッシュに保存
-    data_dir = os.path.join(os.path.dirname(__file__), "data")
-    os.makedirs(data_dir, exist_ok=True)
-    with open(os.path.join(data_dir, "past_tweets.json"), "w", encoding="utf-8") as f:
-        json.dump(tweets, f, ensure_ascii=False, indent=2)
+    # 過去ツイートをキャッシュに保存（機械読み取り専用のため整形しない）
+    DATA_DIR.mkdir(exist_ok=True)
+    save_json(DATA_DIR / "past_tweets.json", tweets, pretty=False)
 
     return analyzer.get_style_prompt_fragment(profile)
 
@@ -130,12 +129,12 @@ def run_research(api_client, auto=False):
 
 def generate_tweets(style_prompt, reference_tweets, count=10):
     """ツイート生成"""
-    from src.content_engine import ContentEngine
+    from src.content_engine import ASYNC_BATCH_THRESHOLD, ContentEngine
 
     # ユーザーのアイデアを読み込む
     user_thoughts = None
-    ideas_path = os.path.join(os.path.dirname(__file__), "data", "ideas.txt")
-    if os.path.exists(ideas_path):
+    ideas_path = DATA_DIR / "ideas.txt"
+    if ideas_path.exists():
         try:
             with open(ideas_path, "r", encoding="utf-8") as f:
                 content = f.read().strip()
@@ -153,11 +152,21 @@ def generate_tweets(style_prompt, reference_tweets, count=10):
     ref_texts = [t["text"] for t in reference_tweets[:5]] if reference_tweets else None
 
     print(f"\n✍️  ツイートを {count} 件生成中...")
-    tweets = engine.generate_batch(
-        count=count,
-        reference_tweets=ref_texts,
-        user_thoughts=user_thoughts
-    )
+    if count >= ASYNC_BATCH_THRESHOLD:
+        # 大量件数は非同期の並列リクエストで生成
+        tweets = asyncio.run(
+            engine.agenerate_batch(
+                count=count,
+                reference_tweets=ref_texts,
+                user_thoughts=user_thoughts,
+            )
+        )
+    else:
+        tweets = engine.generate_batch(
+            count=count,
+            reference_tweets=ref_texts,
+            user_thoughts=user_thoughts
+        )
     print(f"  生成完了: {len(tweets)} 件")
     return tweets
 
@@ -215,21 +224,13 @@ def schedule_tweets(approved_tweets: list[str], api_client):
     from src.scheduler import PostScheduler
 
     scheduler = PostScheduler(api_client=api_client)
-    scheduler.stock_tweets(approved_tweets)
-
-    # タイムスロットを割り当て（最大10件まで）
-    pending = scheduler.get_pending_tweets(count=10)
-    assigned = scheduler.assign_time_slots(pending)
-
-    # 更新を保存
-    all_scheduled = scheduler._load_scheduled()
-    for item in all_scheduled:
-        for assigned_item in assigned:
-            if item["text"] == assigned_item["text"] and item["status"] == "pending":
-                item["scheduled_time"] = assigned_item.get("scheduled_time")
-                item["period"] = assigned_item.get("period")
-                break
-    scheduler._save_scheduled(all_scheduled)
+
+    # ストック追加とタイムスロット割り当てを1回の読み込み・保存で行う
+    with scheduler.edit_scheduled() as all_scheduled:
+        all_scheduled.extend(scheduler.make_stock_items(approved_tweets))
+        # タイムスロットを割り当て（最大10件まで）。同じ dict を直接更新する
+        pending = [item for item in all_scheduled if item["status"] == "pending"][:10]
+        scheduler.assign_time_slots(pending)
 
     print(scheduler.get_schedule_summary())
     return scheduler
@@ -287,6 +288,16 @@ def main():
 
     args = parser.parse_args()
 
+    # 状況確認・クリアだけの起動ではログファイルを開かない（--help は parse_args で終了済み）。
+    # argparse が受け付ける省略形（--stat など）も、解析後のフラグで判定するので漏れない
+    if not (args.status or args.clear):
+        file_handler = logging.FileHandler("x_auto.log", encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+        logging.getLogger().addHandler(file_handler)
+
+    # --help などで即終了する場合に .env の読み込みを待たせない
+    load_dotenv()
+
     print("=" * 60)
     print("🚀 X自動運用システム")
     print(f"   アカウント: @{os.getenv('X_USERNAME', '3m6LGY8PTkQKx63')}")
@@ -323,8 +334,11 @@ def main():
         from src.content_engine import ContentEngine
         from src.engagement_handler import EngagementHandler
 
+        run_schedule = args.execute_scheduled or args.cron
+        run_engage = args.engage or args.cron
+
         # スケジュール投稿のチェック
-        if args.execute_scheduled or args.cron:
+        if run_schedule:
             scheduler = PostScheduler(api_client=api_client)
             print("\n⏳ 予約投稿をチェック中...")
             results = scheduler.execute_scheduled(dry_run=args.dry_run)
@@ -333,18 +347,26 @@ def main():
             else:
                 print("📭 現在、実行待ちの予約投稿はありません")
 
+        # APIクライアント・生成エンジンは1つを全ハンドラで共有し、
+        # 認証済みセッションとユーザーIDの解決結果を使い回す
+        engine = ContentEngine() if (args.reply or run_engage) else None
+        replier = ReplyHandler(api_client=api_client, content_engine=engine) if args.reply else None
+        engager = EngagementHandler(api_client=api_client, content_engine=engine) if run_engage else None
+
+        if api_client and (replier or engager):
+            try:
+                api_client.user_id  # 先に1回だけ解決（ディスクキャッシュがあればAPI呼出なし）
+            except Exception as e:
+                logger.warning(f"ユーザーIDの事前取得に失敗: {e}")
+
         # 自動リプライのチェック（明示的に --reply が指定された場合のみ）
-        if args.reply:
-            engine = ContentEngine()
-            replier = ReplyHandler(api_client=api_client, content_engine=engine)
+        if replier:
             print("\n📩 メンションをチェック中...")
             replier.run(dry_run=args.dry_run)
             print("✅ メンションチェック完了")
         
         # エゴサ・いいね・引用RTのチェック
-        if args.engage or args.cron:
-            engine = ContentEngine()
-            engager = EngagementHandler(api_client=api_client, content_engine=engine)
+        if engager:
             print("\n🔍 エゴサ・いいねを実行中...")
             engager.run_ego_search_and_like(dry_run=args.dry_run)
             
@@ -397,19 +419,17 @@ def main():
             from src.scheduler import PostScheduler
 
             scheduler = PostScheduler(api_client=api_client)
-            # 一旦ストックに追加（履歴管理のため）
-            scheduler.stock_tweets(approved)
-            
-            # 強制的に時間を現在にして実行
-            # 注意: stock_tweetsで追加された最新のpendingアイテムのみを対象とする
-            # 簡易実装として、pendingのものをすべて実行対象にする（通常は1件のみのはず）
-            all_scheduled = scheduler._load_scheduled()
-            for item in all_scheduled:
-                if item["status"] == "pending":
-                    # 過去の時間に設定して実行対象にする
-                    item["scheduled_time"] = (datetime.now() - timedelta(minutes=1)).isoformat()
-            
-            scheduler._save_scheduled(all_scheduled)
+            with scheduler.edit_scheduled() as all_scheduled:
+                # 一旦ストックに追加（履歴管理のため）
+                all_scheduled.extend(scheduler.make_stock_items(approved))
+
+                # 強制的に時間を現在にして実行
+                # 簡易実装として、pendingのものをすべて実行対象にする（通常は1件のみのはず）
+                for item in all_scheduled:
+                    if item["status"] == "pending":
+                        # 過去の時間に設定して実行対象にする
+                        item["scheduled_time"] = (datetime.now() - timedelta(minutes=1)).isoformat()
+
             scheduler.execute_scheduled(dry_run=args.dry_run)
             print("✨ 投稿完了")
             return
@@ -13,6 +13,8 @@ import tweepy
 from dotenv import load_dotenv
 import os
 
+from src.storage import ensure_data_dir, load_json, save_json
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -41,7 +43,12 @@ class XAPIClient:
         )
 
         self.username = os.getenv("X_USERNAME", "3m6LGY8PTkQKx63")
-        self._user_id: Optional[str] = None
+
+        # ユーザーIDは不変なので、プロセスをまたいでディスクにキャッシュする
+        # （Git 管理外。GitHub Actions の各実行では毎回空から始まるので、効くのはローカル実行とデーモン）
+        self.data_dir = ensure_data_dir()
+        self.user_id_cache_file = os.path.join(self.data_dir, "user_id.cache.json")
+        self._user_id: Optional[str] = self._load_cached_user_id()
 
     def _validate_credentials(self):
         """APIキーが全て設定されているか検証"""
@@ -61,15 +68,40 @@ class XAPIClient:
 
     @property
     def user_id(self) -> str:
-        """自分のユーザーIDを取得（キャッシュ付き）"""
+        """自分のユーザーIDを取得（メモリ・ディスクキャッシュ付き）"""
         if self._user_id is None:
             user = self.client.get_user(username=self.username)
             if user.data:
                 self._user_id = str(user.data.id)
+                self._save_cached_user_id()
             else:
                 raise ValueError(f"ユーザー @{self.username} が見つかりません。")
         return self._user_id
 
+    def _load_user_id_cache(self) -> dict:
+        """ユーザーIDキャッシュファイル（{username: id}）を読み込み"""
+        if not os.path.exists(self.user_id_cache_file):
+            return {}
+        try:
+            cache = load_json(self.user_id_cache_file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"ユーザーIDキャッシュの読み込み失敗: {e}")
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _load_cached_user_id(self) -> Optional[str]:
+        """キャッシュ済みのユーザーIDを取得（なければ None）"""
+        return self._load_user_id_cache().get(self.username)
+
+    def _save_cached_user_id(self):
+        """取得したユーザーIDをキャッシュファイルに保存"""
+        cache = self._load_user_id_cache()
+        cache[self.username] = self._user_id
+        try:
+            save_json(self.user_id_cache_file, cache)
+        except OSError as e:
+            logger.warning(f"ユーザーIDキャッシュの保存失敗: {e}")
+
     def post_tweet(self, text: str, reply_to_id: Optional[str] = None) -> dict:
         """
         ツイートを投稿する（返信も可能）。
@@ -210,16 +242,15 @@ class XAPIClient:
                 logger.warning("ツイートが見つかりませんでした。")
                 return []
 
-            results = []
-            for tweet in tweets.data:
-                results.append(
-                    {
-                        "id": str(tweet.id),
-                        "text": tweet.text,
-                        "created_at": str(tweet.created_at) if tweet.created_at else None,
-                        "metrics": tweet.public_metrics if tweet.public_metrics else {},
-                    }
-                )
+            results = [
+                {
+                    "id": str(tweet.id),
+                    "text": tweet.text,
+                    "created_at": str(tweet.created_at) if tweet.created_at else None,
+                    "metrics": tweet.public_metrics or {},
+                }
+                for tweet in tweets.data
+            ]
             logger.info(f"過去ツイート {len(results)} 件取得完了")
             return results
         except tweepy.TweepyException as e:
@@ -252,26 +283,31 @@ class XAPIClient:
                 logger.info(f"検索結果なし: {query}")
                 return []
 
-            results = []
+            # (エンゲージメントスコア, 結果) の組を作り、スコアは1回だけ計算する
+            scored = []
             for tweet in tweets.data:
                 metrics = tweet.public_metrics or {}
-                results.append(
-                    {
-                        "id": str(tweet.id),
-                        "text": tweet.text,
-                        "author_id": str(tweet.author_id) if tweet.author_id else None,
-                        "created_at": str(tweet.created_at) if tweet.created_at else None,
-                        "like_count": metrics.get("like_count", 0),
-                        "retweet_count": metrics.get("retweet_count", 0),
-                        "reply_count": metrics.get("reply_count", 0),
-                        "impression_count": metrics.get("impression_count", 0),
-                    }
+                like_count = metrics.get("like_count", 0)
+                retweet_count = metrics.get("retweet_count", 0)
+                scored.append(
+                    (
+                        like_count + retweet_count * 2,
+                        {
+                            "id": str(tweet.id),
+                            "text": tweet.text,
+                            "author_id": str(tweet.author_id) if tweet.author_id else None,
+                            "created_at": str(tweet.created_at) if tweet.created_at else None,
+                            "like_count": like_count,
+                            "retweet_count": retweet_count,
+                            "reply_count": metrics.get("reply_count", 0),
+                            "impression_count": metrics.get("impression_count", 0),
+                        },
+                    )
                 )
 
             # エンゲージメント順にソート
-            results.sort(
-                key=lambda x: x["like_count"] + x["retweet_count"] * 2, reverse=True
-            )
+            scored.sort(key=lambda x: x[0], reverse=True)
+            results = [result for _, result in scored]
             logger.info(f"検索完了: {query} → {len(results)} 件")
             return results
 
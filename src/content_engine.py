@@ -5,13 +5,22 @@ Content Engine - Claude APIを活用した投稿生成モジュール
 ペルソナとスタイル分析に基づき、140文字以内の投稿案を生成する。
 """
 
+import asyncio
+import json
 import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager
 
 import anthropic
 from dotenv import load_dotenv
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -25,6 +34,40 @@ PERSONA = """あなたは「次世代の生き方を提唱するAI戦略家」
 - 口調は「だ・である」調（断定形）で統一する。質問形や「〜しましょう」といった呼びかけは避ける
 - 感情的な装飾を排し、論理と洞察で語る"""
 
+# 投稿生成の絶対ルール
+_ABSOLUTE_RULES = """【絶対ルール】
+1. 110文字〜135文字程度で、内容の濃い投稿テキストを出力すること
+2. ハッシュタグ（#）は絶対に使用しない
+3. 投資助言に該当する断定的表現は避ける（「買い」「売り」「必ず儲かる」等は禁止）
+4. 思考法やトレンドの紹介に留め、具体的な銘柄推奨はしない
+5. URLやメンションは含めない"""
+
+# システムプロンプトの固定部分（投稿・返信・引用RT）。呼び出しごとに組み立て直さないよう
+# モジュールロード時に1回だけ生成し、system ブロックとしてそのまま使う
+# （プロンプトキャッシュは指定しない。固定部分は数百トークンで、API がキャッシュできる
+#   最小長（Sonnet で1024トークン）に届かず、指定しても一度もキャッシュされないため）
+_TWEET_SYSTEM_STATIC = f"{PERSONA}\n\n{_ABSOLUTE_RULES}"
+
+_REPLY_SYSTEM_STATIC = f"""{PERSONA}
+
+【返信のルール】
+1. 相手の言葉に対して、鋭い洞察や有益なアドバイス（AI戦略家として）を返すこと
+2. 媚びたり、当たり障りのない挨拶だけで終わらせないこと
+3. 「だ・である」調を維持し、100文字〜130文字程度で密度を高めること
+4. 相手のユーザー名（@ユーザー名）を文頭に含めること
+5. ハッシュタグ、URLは含めない
+"""
+
+_QUOTE_SYSTEM_STATIC = f"""{PERSONA}
+
+【引用ツイートのルール】
+1. 引用元の内容に対して、補足、反論、または独自の付加価値（AI戦略家としての視点）を加えること
+2. 感情的な反応ではなく、論理的で鋭い分析を行うこと
+3. 単なる賛成や紹介ではなく、読者が「なるほど」と思う新しい切り口を提示すること
+4. 「だ・である」調の断定形で、100文字〜130文字程度で密度を高めること
+5. ハッシュタグ、URLは含めない
+"""
+
 # 禁止表現（過度な煽りや投資助言回避）
 BANNED_EXPRESSIONS = [
     "絶対に儲かる", "100%成功", "誰でも簡単", "何もしなくていい",
@@ -32,6 +75,45 @@ BANNED_EXPRESSIONS = [
     "投資推奨", "買い時", "売り時",
 ]
 
+# 呼び出しごとの再コンパイル・キャッシュ参照を避けるため、正規表現はモジュールロード時に構築
+# LLM出力の前後の装飾（引用符・マークダウンの * ・先頭の番号）を1回の置換でまとめて除去する。
+# 「引用符を strip → * を除去 → 番号を除去」を順に行った場合と同じ結果になる
+_CLEAN_RE = re.compile(
+    r"\A[\"'「」『』]*\**(?:\d+[\.\)]\s*)?"
+    r"|\*+\n?[\"'「」『』]*\Z"
+    r"|[\"'「」『』]+\Z"
+)
+_URL_RE = re.compile(r"https?://")
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+# 禁止表現は1回の走査で検出する。pyahocorasick があれば Aho–Corasick オートマトン、
+# なければ全表現を1つにまとめた選択パターンを使う
+_BANNED_RE = re.compile("|".join(re.escape(e) for e in BANNED_EXPRESSIONS))
+if ahocorasick is not None:
+    _BANNED_AUTOMATON = ahocorasick.Automaton()
+    for _expr in BANNED_EXPRESSIONS:
+        _BANNED_AUTOMATON.add_word(_expr, _expr)
+    _BANNED_AUTOMATON.make_automaton()
+else:
+    _BANNED_AUTOMATON = None
+
+
+def _find_banned_expression(text: str) -> str | None:
+    """テキストに含まれる禁止表現を1つ返す（なければ None）"""
+    if _BANNED_AUTOMATON is not None:
+        hit = next(_BANNED_AUTOMATON.iter(text), None)
+        return hit[1] if hit else None
+    match = _BANNED_RE.search(text)
+    return match.group(0) if match else None
+
+
+# ストリーミング生成中にこの文字数を超えたら、140文字に収まる見込みはないとみなして打ち切る
+# （引用符・番号などクリーニングで削られる分の余裕を含む）
+STREAM_ABORT_CHARS = 180
+
+# この件数以上の一括生成は、1リクエストにまとめず非同期の並列リクエストで行う
+# （1リクエストの出力トークンが大きくなりすぎると、生成待ちが逆に支配的になるため）
+ASYNC_BATCH_THRESHOLD = 20
+
 # 投稿テーマカテゴリ
 CONTENT_THEMES = [
     "AIツール（Claude Code, Antigravity, NotebookLM等）の活用法",
@@ -59,10 +141,43 @@ class ContentEngine:
                 "ANTHROPIC_API_KEY が .env に設定されていません。"
             )
 
+        self._api_key = api_key
         self.client = anthropic.Anthropic(api_key=api_key)
+        # 非同期クライアントはイベントループごとに async_session() の中で作る
+        self.aclient: anthropic.AsyncAnthropic | None = None
         self.style_prompt = style_prompt
         self.model = "claude-sonnet-4-20250514"
 
+    @property
+    def style_prompt(self) -> str:
+        """StyleAnalyzer から生成されたスタイル指示テキスト"""
+        return self._style_prompt
+
+    @style_prompt.setter
+    def style_prompt(self, value: str):
+        # システムプロンプトは style_prompt にのみ依存するため、設定時に一度だけ構築し、
+        # 全リクエストに使い回す
+        self._style_prompt = value
+        self._system_blocks = self._build_system_blocks(self._build_system_prompt(), value)
+
+    @asynccontextmanager
+    async def async_session(self):
+        """
+        現在のイベントループ用の AsyncAnthropic を self.aclient に用意し、抜けるときに閉じる。
+        AsyncAnthropic の接続プールは最初に使ったイベントループに結び付くため、
+        asyncio.run を呼ぶたびに、その中でこのスコープを開いて作り直す
+        （既に用意されている場合は入れ子とみなしてそのまま使う）。
+        """
+        if self.aclient is not None:
+            yield self.aclient
+            return
+        self.aclient = anthropic.AsyncAnthropic(api_key=self._api_key)
+        try:
+            yield self.aclient
+        finally:
+            client, self.aclient = self.aclient, None
+            await client.close()
+
     def generate_tweet(
         self,
         theme: str = "",
@@ -82,48 +197,108 @@ class ContentEngine:
         Returns:
             生成されたツイートテキスト
         """
-        if not theme and not user_thoughts:
-            import random
-            theme = random.choice(CONTENT_THEMES)
-
-        system_prompt = self._build_system_prompt()
-        user_prompt = self._build_user_prompt(theme, reference_tweets, user_thoughts)
+        source, user_prompt = self._prepare_tweet_prompt(theme, reference_tweets, user_thoughts)
 
         for attempt in range(max_retries):
             try:
-                response = self.client.messages.create(
-                    model=self.model,
-                    max_tokens=300,
-                    system=system_prompt,
-                    messages=[{"role": "user", "content": user_prompt}],
-                    temperature=0.8,
-                )
+                # ストリーミングで受け取り、長すぎることが分かった時点で残りの生成を待たずに打ち切る
+                tweet_text = ""
+                with self.client.messages.stream(**self._tweet_request(user_prompt)) as stream:
+                    for chunk in stream.text_stream:
+                        tweet_text += chunk
+                        if len(tweet_text) > STREAM_ABORT_CHARS:
+                            break
+            except anthropic.APIError as e:
+                logger.error(f"Claude API エラー: {e}")
+                raise
 
-                tweet_text = response.content[0].text.strip()
-                # 余計な引用符やマークダウンを除去
-                tweet_text = self._clean_output(tweet_text)
+            tweet_text, retry_note = self._review_streamed_tweet(tweet_text, attempt, source)
+            if tweet_text is not None:
+                return tweet_text
+            user_prompt += retry_note
 
-                # バリデーション
-                is_valid, issue = self.validate_tweet(tweet_text)
-                if is_valid:
-                    source = "思考メモ" if user_thoughts else f"テーマ: {theme}"
-                    logger.info(
-                        f"ツイート生成成功 ({len(tweet_text)}文字, {source})"
-                    )
-                    return tweet_text
-
-                logger.warning(
-                    f"バリデーション失敗 (attempt {attempt + 1}): {issue} → リトライ"
-                )
-                # リトライ時に文字数制限を強調
-                user_prompt += f"\n\n※前回の生成では「{issue}」問題がありました。必ず140文字以内にしてください。"
+        raise ValueError(f"ツイート生成に{max_retries}回失敗しました。")
 
+    async def _agenerate_tweet(
+        self,
+        theme: str = "",
+        reference_tweets: list[str] | None = None,
+        user_thoughts: str | None = None,
+        max_retries: int = 3,
+    ) -> str:
+        """generate_tweet の非同期版（async_session() の中で呼ぶ）。引数・戻り値は同じ。"""
+        source, user_prompt = self._prepare_tweet_prompt(theme, reference_tweets, user_thoughts)
+
+        for attempt in range(max_retries):
+            try:
+                tweet_text = ""
+                async with self.aclient.messages.stream(**self._tweet_request(user_prompt)) as stream:
+                    async for chunk in stream.text_stream:
+                        tweet_text += chunk
+                        if len(tweet_text) > STREAM_ABORT_CHARS:
+                            break
             except anthropic.APIError as e:
                 logger.error(f"Claude API エラー: {e}")
                 raise
 
+            tweet_text, retry_note = self._review_streamed_tweet(tweet_text, attempt, source)
+            if tweet_text is not None:
+                return tweet_text
+            user_prompt += retry_note
+
         raise ValueError(f"ツイート生成に{max_retries}回失敗しました。")
 
+    def _prepare_tweet_prompt(
+        self,
+        theme: str,
+        reference_tweets: list[str] | None,
+        user_thoughts: str | None,
+    ) -> tuple[str, str]:
+        """ツイート生成の (ログ用の生成元, ユーザープロンプト) を構築（テーマ未指定ならランダム選択）"""
+        if not theme and not user_thoughts:
+            import random
+            theme = random.choice(CONTENT_THEMES)
+
+        source = "思考メモ" if user_thoughts else f"テーマ: {theme}"
+        return source, self._build_user_prompt(theme, reference_tweets, user_thoughts)
+
+    def _tweet_request(self, user_prompt: str) -> dict:
+        """ツイート1件分の messages.stream の引数"""
+        return {
+            "model": self.model,
+            "max_tokens": 300,
+            "system": self._system_blocks,
+            "messages": [{"role": "user", "content": user_prompt}],
+            "temperature": 0.8,
+        }
+
+    def _review_streamed_tweet(
+        self, tweet_text: str, attempt: int, source: str
+    ) -> tuple[str | None, str]:
+        """
+        ストリーミングで受け取った1回分の出力を後処理・検証する（同期・非同期版で共通）。
+
+        Returns:
+            (合格したツイート（不合格なら None）, リトライ時にプロンプトへ足す注意書き)
+        """
+        if len(tweet_text) > STREAM_ABORT_CHARS:
+            is_valid, issue = False, f"文字数超過 ({STREAM_ABORT_CHARS}文字超で生成を中断)"
+        else:
+            # 余計な引用符やマークダウンを除去
+            tweet_text = self._clean_output(tweet_text.strip())
+            # バリデーション
+            is_valid, issue = self.validate_tweet(tweet_text)
+
+        if is_valid:
+            logger.info(f"ツイート生成成功 ({len(tweet_text)}文字, {source})")
+            return tweet_text, ""
+
+        logger.warning(
+            f"バリデーション失敗 (attempt {attempt + 1}): {issue} → リトライ"
+        )
+        # リトライ時に文字数制限を強調
+        return None, f"\n\n※前回の生成では「{issue}」問題がありました。必ず140文字以内にしてください。"
+
     def generate_reply(
         self,
         mention_text: str,
@@ -142,26 +317,16 @@ class ContentEngine:
         Returns:
             返信テキスト
         """
-        system_prompt = f"""{PERSONA}
-
-【返信のルール】
-1. 相手の言葉に対して、鋭い洞察や有益なアドバイス（AI戦略家として）を返すこと
-2. 媚びたり、当たり障りのない挨拶だけで終わらせないこと
-3. 「だ・である」調を維持し、100文字〜130文字程度で密度を高めること
-4. 相手のユーザー名（@{author_username}）を文頭に含めること
-5. ハッシュタグ、URLは含めない
-"""
-        user_prompt = f"以下のユーザーからの投稿に対して、返信を1件作成してください。\n\n【相手の投稿】\n@{author_username}: {mention_text}"
-        
-        if context_tweets:
-            user_prompt += "\n\n【会話の以前の流れ】\n" + "\n".join(context_tweets)
+        system_blocks, user_prompt = self._build_reply_request(
+            mention_text, author_username, context_tweets
+        )
 
         for attempt in range(max_retries):
             try:
                 response = self.client.messages.create(
                     model=self.model,
                     max_tokens=300,
-                    system=system_prompt,
+                    system=system_blocks,
                     messages=[{"role": "user", "content": user_prompt}],
                     temperature=0.7,
                 )
@@ -179,6 +344,58 @@ class ContentEngine:
 
         raise ValueError("返信の文字数制限をクリアできませんでした。")
 
+    async def agenerate_reply(
+        self,
+        mention_text: str,
+        author_username: str,
+        context_tweets: list[str] | None = None,
+        max_retries: int = 3,
+    ) -> str:
+        """generate_reply の非同期版（async_session() の中で呼ぶ）。引数・戻り値は同じ。"""
+        system_blocks, user_prompt = self._build_reply_request(
+            mention_text, author_username, context_tweets
+        )
+
+        for attempt in range(max_retries):
+            try:
+                response = await self.aclient.messages.create(
+                    model=self.model,
+                    max_tokens=300,
+                    system=system_blocks,
+                    messages=[{"role": "user", "content": user_prompt}],
+                    temperature=0.7,
+                )
+                reply_text = self._clean_output(response.content[0].text.strip())
+
+                if len(reply_text) <= 140:
+                    return reply_text
+
+                logger.warning(f"返信文字数超過 ({len(reply_text)}文字) - リトライ中...")
+                user_prompt += f"\n\n※前回の出力は140文字を超えていました。必ず140文字以内に短縮してください。"
+            except Exception as e:
+                logger.error(f"返信生成失敗: {e}")
+                raise
+
+        raise ValueError("返信の文字数制限をクリアできませんでした。")
+
+    def _build_reply_request(
+        self,
+        mention_text: str,
+        author_username: str,
+        context_tweets: list[str] | None,
+    ) -> tuple[list[dict], str]:
+        """返信生成用の (system ブロック, ユーザープロンプト) を構築"""
+        # 返信相手によって変わるのはユーザー名だけなので、ルール部分とは別ブロックにする
+        system_blocks = self._build_system_blocks(
+            _REPLY_SYSTEM_STATIC, f"返信相手のユーザー名: @{author_username}"
+        )
+        user_prompt = f"以下のユーザーからの投稿に対して、返信を1件作成してください。\n\n【相手の投稿】\n@{author_username}: {mention_text}"
+        
+        if context_tweets:
+            user_prompt += "\n\n【会話の以前の流れ】\n" + "\n".join(context_tweets)
+
+        return system_blocks, user_prompt
+
     def generate_quote_comment(
         self,
         original_tweet_text: str,
@@ -193,15 +410,7 @@ class ContentEngine:
         Returns:
             コメントテキスト
         """
-        system_prompt = f"""{PERSONA}
-
-【引用ツイートのルール】
-1. 引用元の内容に対して、補足、反論、または独自の付加価値（AI戦略家としての視点）を加えること
-2. 感情的な反応ではなく、論理的で鋭い分析を行うこと
-3. 単なる賛成や紹介ではなく、読者が「なるほど」と思う新しい切り口を提示すること
-4. 「だ・である」調の断定形で、100文字〜130文字程度で密度を高めること
-5. ハッシュタグ、URLは含めない
-"""
+        system_blocks = self._build_system_blocks(_QUOTE_SYSTEM_STATIC)
         user_prompt = f"以下の投稿を引用して、あなたの専門的な見解を添えてください。\n\n【引用元】\n{original_tweet_text}"
 
         for attempt in range(max_retries):
@@ -209,7 +418,7 @@ class ContentEngine:
                 response = self.client.messages.create(
                     model=self.model,
                     max_tokens=300,
-                    system=system_prompt,
+                    system=system_blocks,
                     messages=[{"role": "user", "content": user_prompt}],
                     temperature=0.7,
                 )
@@ -232,115 +441,293 @@ class ContentEngine:
         count: int = 10,
         reference_tweets: list[str] | None = None,
         user_thoughts: str | None = None,
+        max_workers: int = 8,
     ) -> list[str]:
         """
         複数のツイートを一括生成する。
         user_thoughtsがある場合は、内容の重複を避けるために一括でプロンプトを送り、
         多様な視点から生成させる。
+        テーマベースの場合も、テーマ一覧を1回のリクエストにまとめてJSON配列で受け取る。
 
         Args:
             count: 生成件数
             reference_tweets: 参考バズ投稿リスト
             user_thoughts: ユーザーの思考メモ
+            max_workers: 個別再生成を並列実行する際の最大スレッド数
 
         Returns:
             生成されたツイートリスト
         """
         if user_thoughts:
-            return self._generate_varied_batch_from_thoughts(count, reference_tweets, user_thoughts)
+            return self._generate_varied_batch_from_thoughts(
+                count, reference_tweets, user_thoughts, max_workers
+            )
 
-        # 通常のテーマベース生成（ループ）
-        import random
-        tweets = []
-        themes = random.sample(CONTENT_THEMES, min(count, len(CONTENT_THEMES)))
-        while len(themes) < count:
-            themes.append(random.choice(CONTENT_THEMES))
+        # 通常のテーマベース生成（1リクエストで一括生成）
+        themes = self._pick_themes(count)
+        return self._generate_batch_from_themes(themes, reference_tweets, max_workers)
 
-        for i, theme in enumerate(themes):
-            try:
-                tweet = self.generate_tweet(
-                    theme=theme,
-                    reference_tweets=reference_tweets,
-                    user_thoughts=None,
-                )
-                tweets.append(tweet)
-                logger.info(f"バッチ生成 [{i + 1}/{count}] 完了")
-            except Exception as e:
-                logger.error(f"バッチ生成 [{i + 1}/{count}] 失敗: {e}")
+    async def agenerate_batch(
+        self,
+        count: int = 10,
+        reference_tweets: list[str] | None = None,
+        user_thoughts: str | None = None,
+        max_concurrent: int = 8,
+    ) -> list[str]:
+        """
+        generate_batch の非同期版（大量件数向け）。
+        テーマごとのリクエストを1つのイベントループ上で同時に投げる。
+
+        Args:
+            count: 生成件数
+            reference_tweets: 参考バズ投稿リスト
+            user_thoughts: ユーザーの思考メモ（ある場合は従来どおり1リクエストで生成）
+            max_concurrent: 同時リクエスト数の上限（レート制限対策）
+
+        Returns:
+            生成されたツイートリスト
+        """
+        if user_thoughts:
+            return await asyncio.to_thread(
+                self._generate_varied_batch_from_thoughts, count, reference_tweets, user_thoughts
+            )
+
+        themes = self._pick_themes(count)
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def generate(theme: str) -> str:
+            async with semaphore:
+                return await self._agenerate_tweet(theme=theme, reference_tweets=reference_tweets)
+
+        async with self.async_session():
+            results = await asyncio.gather(
+                *(generate(theme) for theme in themes), return_exceptions=True
+            )
+
+        tweets = []
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logger.error(f"バッチ生成 [{i + 1}/{count}] 失敗: {result}")
                 continue
+            tweets.append(result)
+            logger.info(f"バッチ生成 [{i + 1}/{count}] 完了")
         return tweets
 
-    def _generate_varied_batch_from_thoughts(
-        self, count: int, reference_tweets: list[str] | None, user_thoughts: str
+    def _pick_themes(self, count: int) -> list[str]:
+        """
+        一括生成用のテーマを count 件選ぶ。
+        テーマ数を超える場合もシャッフルした一巡を繰り返し、同じテーマの偏りを避ける。
+        """
+        import random
+        themes = []
+        while len(themes) < count:
+            themes.extend(random.sample(CONTENT_THEMES, min(count - len(themes), len(CONTENT_THEMES))))
+        return themes
+
+    def _generate_batch_from_themes(
+        self,
+        themes: list[str],
+        reference_tweets: list[str] | None,
+        max_workers: int = 8,
+        max_rounds: int = 2,
     ) -> list[str]:
-        """思考メモから、重複のない多様なツイートを生成する"""
-        system_prompt = self._build_system_prompt()
-        
-        user_prompt = f"""以下の【ユーザーの思考メモ】を読み込み、内容が重複しないように {count} 件の異なる投稿を作成してください。
+        """
+        テーマごとの投稿を1回のAPIリクエストでまとめて生成する。
+        バリデーションに失敗した項目は、失敗理由をまとめた修正依頼を1回のリクエストで送り
+        （一括リクエストは合計 max_rounds 回まで）、それでも残った項目のみ
+        generate_tweet で個別に再生成する（スレッド並列）。
+        """
+        count = len(themes)
+        results: list[str | None] = [None] * count
+        retry_indices = list(range(count))
+        user_prompt = self._build_batch_user_prompt(themes, reference_tweets)
+
+        for batch_round in range(max_rounds):
+            texts = self._request_batch(user_prompt, len(retry_indices), count)
+
+            failed = []
+            for i in retry_indices:
+                text = texts[i]
+                if text is None:
+                    failed.append((i, "出力に含まれていませんでした", None))
+                    continue
+                text = self._clean_output(text)
+                is_valid, issue = self.validate_tweet(text)
+                if is_valid:
+                    results[i] = text
+                    logger.info(f"バッチ生成 [{i + 1}/{count}] 完了 ({len(text)}文字)")
+                    continue
+                logger.warning(f"バッチ生成 [{i + 1}/{count}] バリデーション失敗: {issue}")
+                failed.append((i, issue, text))
+
+            retry_indices = [i for i, _, _ in failed]
+            if not failed or batch_round == max_rounds - 1:
+                break
+            logger.info(f"バッチ生成: {len(failed)} 件をまとめて修正依頼")
+            user_prompt = self._build_batch_fix_prompt(themes, failed)
+
+        if retry_indices:
+            regenerated = self._generate_individually(
+                [{"theme": themes[i], "reference_tweets": reference_tweets} for i in retry_indices],
+                max_workers,
+            )
+            for i, text in zip(retry_indices, regenerated):
+                if text is not None:
+                    results[i] = text
+                    logger.info(f"バッチ生成 [{i + 1}/{count}] 個別再生成で完了")
 
-【戦略】
-1. メモの中の異なるセクション、異なる視点、異なるエピソードに焦点を当てて、1つずつ独立した投稿にすること。
-2. 全体として1つのストーリーにするのではなく、それぞれが単体で完結する「強い」投稿にすること。
-3. すべて「だ・である」調の断定形で、ペルソナ（AI戦略家）らしい鋭い洞察を含めること。
+        return [t for t in results if t is not None]
 
-【ユーザーの思考メモ】
-{user_thoughts}
-"""
-        if reference_tweets:
-            user_prompt += "\n【構造の参考】\n"
-            for i, ref in enumerate(reference_tweets[:2], 1):
-                user_prompt += f"参考{i}: {ref}\n"
+    def _generate_individually(self, requests: list[dict], max_workers: int = 8) -> list[str | None]:
+        """
+        generate_tweet を複数件まとめて実行する。
+        個別再生成はネットワーク待ちが支配的なため、スレッドで並列に投げる。
+        generate_tweet 自体がバリデーションとリトライを行うので、1件につき1回だけ呼ぶ。
+
+        Args:
+            requests: generate_tweet に渡すキーワード引数のリスト
+            max_workers: 最大スレッド数
 
-        user_prompt += f"\n出力形式：\n1. [投稿テキスト]\n2. [投稿テキスト]\n...(合計 {count} 件)"
+        Returns:
+            requests と同じ順序のツイートリスト（失敗した位置は None）
+        """
+        results: list[str | None] = [None] * len(requests)
+        if not requests:
+            return results
+        workers = max(1, min(len(requests), max_workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.generate_tweet, **kwargs): i
+                for i, kwargs in enumerate(requests)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except (anthropic.APIError, ValueError) as e:
+                    logger.error(f"個別生成 [{i + 1}/{len(requests)}] 失敗: {e}")
+        return results
 
+    def _request_batch(
+        self,
+        user_prompt: str,
+        item_count: int,
+        count: int,
+        temperature: float = 0.8,
+    ) -> list[str | None]:
+        """
+        一括生成リクエストを1回送り、index 順のテキストリストを返す。
+        出力トークン上限は依頼件数に比例させ、件数が多くても途中で切れないようにする。
+        APIエラー時は全件 None（呼び出し側で再生成される）。
+
+        Args:
+            user_prompt: ユーザーメッセージ
+            item_count: 今回のリクエストで生成させる件数
+            count: index の上限（全体の件数）
+            temperature: 生成時の temperature
+        """
         try:
             response = self.client.messages.create(
                 model=self.model,
-                max_tokens=2000,
-                system=system_prompt,
+                max_tokens=300 * item_count,
+                system=self._system_blocks,
                 messages=[{"role": "user", "content": user_prompt}],
-                temperature=0.7,
+                temperature=temperature,
             )
+        except anthropic.APIError as e:
+            logger.error(f"一括生成リクエスト失敗: {e}")
+            return [None] * count
+        return self._parse_batch_output(response.content[0].text, count)
 
-            raw_output = response.content[0].text.strip()
-            # 番号付きリストを分割
-            items = re.split(r"\n\d+[\.\)]\s*", "\n" + raw_output)
-            tweets = [self._clean_output(it.strip()) for it in items if it.strip()]
-            
-            # バリデーション済みのものだけ採用
-            valid_tweets = []
-            for t in tweets:
-                is_valid, _ = self.validate_tweet(t)
-                if is_valid:
-                    valid_tweets.append(t)
-            
-            # 足りない場合は個別に補完（再帰はせず、テーマなしで生成）
-            while len(valid_tweets) < count:
-                try:
-                    t = self.generate_tweet(user_thoughts=user_thoughts)
-                    valid_tweets.append(t)
-                except:
-                    break
-            
-            return valid_tweets[:count]
+    def _parse_batch_output(self, raw_output: str, count: int) -> list[str | None]:
+        """
+        JSON配列形式の一括生成結果を、index 順のテキストリストに変換する。
 
-        except Exception as e:
-            logger.error(f"多様なバッチ生成に失敗: {e}")
-            return []
+        Returns:
+            長さ count のリスト（取得できなかった位置は None）
+        """
+        texts: list[str | None] = [None] * count
+        # コードブロック（```json ... ```）で囲まれている場合は除去
+        raw_output = _CODE_FENCE_RE.sub("", raw_output.strip())
+
+        try:
+            items = json.loads(raw_output)
+        except json.JSONDecodeError as e:
+            logger.warning(f"一括生成結果のJSON解析に失敗: {e}")
+            return texts
+
+        if not isinstance(items, list):
+            logger.warning("一括生成結果がJSON配列ではありません")
+            return texts
+
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index")
+            text = item.get("text")
+            if (
+                isinstance(index, int)
+                and 1 <= index <= count
+                and isinstance(text, str)
+                and texts[index - 1] is None
+            ):
+                texts[index - 1] = text
+        return texts
+
+    def _generate_varied_batch_from_thoughts(
+        self,
+        count: int,
+        reference_tweets: list[str] | None,
+        user_thoughts: str,
+        max_workers: int = 8,
+    ) -> list[str]:
+        """
+        思考メモから、重複のない多様なツイートを生成する。
+        テーマベースと同じJSON配列形式の一括リクエスト（_request_batch）で count 件を受け取る。
+        """
+        user_prompt = self._build_thoughts_batch_user_prompt(count, reference_tweets, user_thoughts)
+        texts = self._request_batch(user_prompt, count, count, temperature=0.7)
+
+        # バリデーション済みのものだけ採用
+        valid_tweets = []
+        for text in texts:
+            if text is None:
+                continue
+            text = self._clean_output(text)
+            is_valid, _ = self.validate_tweet(text)
+            if is_valid:
+                valid_tweets.append(text)
+
+        # 足りない分だけ個別に並列で補完（再帰はせず、テーマなしで生成）。
+        # 1件あたりのAPI呼び出しは generate_tweet のリトライ回数が上限になる
+        missing = count - len(valid_tweets)
+        if missing > 0:
+            logger.info(f"多様なバッチ生成: 不足 {missing} 件を個別に補完")
+            refills = self._generate_individually(
+                [{"user_thoughts": user_thoughts}] * missing, max_workers
+            )
+            valid_tweets.extend(t for t in refills if t is not None)
+
+        return valid_tweets[:count]
 
     def _build_system_prompt(self) -> str:
-        """システムプロンプトを構築"""
-        prompt = f"""{PERSONA}
+        """システムプロンプトの固定部分（ペルソナ＋絶対ルール）を返す"""
+        return _TWEET_SYSTEM_STATIC
 
-【絶対ルール】
-1. 110文字〜135文字程度で、内容の濃い投稿テキストを出力すること
-2. ハッシュタグ（#）は絶対に使用しない
-3. 投資助言に該当する断定的表現は避ける（「買い」「売り」「必ず儲かる」等は禁止）
-4. 思考法やトレンドの紹介に留め、具体的な銘柄推奨はしない
-5. URLやメンションは含めない
+    def _build_system_blocks(self, static_text: str, dynamic_text: str = "") -> list[dict]:
+        """
+        messages.create の system 引数に渡すブロックを構築。
+        固定部分を先頭に置き、呼び出しごとに変わりうる部分（スタイル指示・返信相手など）は
+        その後ろの別ブロックにする。
 
-{self.style_prompt}"""
-        return prompt
+        Args:
+            static_text: 毎回同一の固定テキスト
+            dynamic_text: 可変テキスト（空の場合はブロックを追加しない）
+        """
+        blocks = [{"type": "text", "text": static_text}]
+        if dynamic_text:
+            blocks.append({"type": "text", "text": dynamic_text})
+        return blocks
 
     def _build_user_prompt(
         self, theme: str, reference_tweets: list[str] | None, user_thoughts: str | None
@@ -364,22 +751,76 @@ class ContentEngine:
         prompt += "\n投稿テキストのみを出力してください（120文字前後を目指してください）。"
         return prompt
 
+    def _build_batch_user_prompt(
+        self, themes: list[str], reference_tweets: list[str] | None
+    ) -> str:
+        """一括生成用のユーザープロンプトを構築（テーマ1件につき投稿1件）"""
+        count = len(themes)
+        prompt = f"以下の {count} 個のテーマについて、テーマごとに1件ずつ、合計 {count} 件の独立した投稿を作成してください。\n\n"
+        prompt += "【テーマ】\n"
+        for i, theme in enumerate(themes, 1):
+            prompt += f"{i}. {theme}\n"
+
+        if reference_tweets:
+            prompt += "\n【参考にすべきバズ投稿の構造・リズム】\n"
+            for i, ref in enumerate(reference_tweets[:3], 1):
+                prompt += f"参考{i}: {ref}\n"
+            prompt += "\n上記のバズ投稿の構造やリズムを参考にしつつ、独自の内容を生成してください。\n"
+
+        prompt += "\n各投稿は120文字前後を目指してください。"
+        prompt += f"\n出力は次の形式のJSON配列のみとし、要素数は必ず {count} 件にしてください（index はテーマ番号、説明文は不要）。\n"
+        prompt += '[{"index": 1, "text": "投稿テキスト"}, {"index": 2, "text": "投稿テキスト"}, ...]'
+        return prompt
+
+    def _build_thoughts_batch_user_prompt(
+        self, count: int, reference_tweets: list[str] | None, user_thoughts: str
+    ) -> str:
+        """思考メモからの一括生成用ユーザープロンプトを構築（出力形式はテーマベースと共通）"""
+        prompt = f"""以下の【ユーザーの思考メモ】を読み込み、内容が重複しないように {count} 件の異なる投稿を作成してください。
+
+【戦略】
+1. メモの中の異なるセクション、異なる視点、異なるエピソードに焦点を当てて、1つずつ独立した投稿にすること。
+2. 全体として1つのストーリーにするのではなく、それぞれが単体で完結する「強い」投稿にすること。
+3. すべて「だ・である」調の断定形で、ペルソナ（AI戦略家）らしい鋭い洞察を含めること。
+
+【ユーザーの思考メモ】
+{user_thoughts}
+"""
+        if reference_tweets:
+            prompt += "\n【構造の参考】\n"
+            for i, ref in enumerate(reference_tweets[:2], 1):
+                prompt += f"参考{i}: {ref}\n"
+
+        prompt += f"\n出力は次の形式のJSON配列のみとし、要素数は必ず {count} 件にしてください（index は投稿番号、説明文は不要）。\n"
+        prompt += '[{"index": 1, "text": "投稿テキスト"}, {"index": 2, "text": "投稿テキスト"}, ...]'
+        return prompt
+
+    def _build_batch_fix_prompt(
+        self, themes: list[str], failed: list[tuple[int, str, str | None]]
+    ) -> str:
+        """一括生成で条件を満たさなかった項目だけを、理由付きでまとめて作り直させるプロンプト"""
+        prompt = "以下の投稿は条件を満たしていませんでした。指摘された問題を修正し、該当するテーマの投稿を作り直してください。\n\n"
+        for i, issue, previous in failed:
+            prompt += f"{i + 1}. テーマ: {themes[i]}\n"
+            prompt += f"   問題: {issue}\n"
+            if previous:
+                prompt += f"   前回の投稿: {previous}\n"
+
+        prompt += "\n各投稿は必ず60文字以上140文字以内にし、ハッシュタグ・URL・メンションは含めないでください。"
+        prompt += f"\n出力は次の形式のJSON配列のみとし、{len(failed)} 件すべてを含めてください（index は上記の番号をそのまま使用、説明文は不要）。\n"
+        prompt += '[{"index": 番号, "text": "投稿テキスト"}, ...]'
+        return prompt
+
     def _clean_output(self, text: str) -> str:
         """LLM出力のクリーニング"""
-        # 前後の引用符を除去
-        text = text.strip('"\'「」『』')
-        # マークダウンの記号を除去
-        text = re.sub(r"^\*+|\*+$", "", text)
-        # 先頭の番号を除去
-        text = re.sub(r"^\d+[\.\)]\s*", "", text)
-        # 複数行の場合は改行を維持しつつ連結
-        if "\n" in text:
-             return text.strip()
-        return text.strip()
+        # 前後の引用符・マークダウンの記号・先頭の番号をまとめて除去
+        return _CLEAN_RE.sub("", text).strip()
 
     def validate_tweet(self, text: str) -> tuple[bool, str]:
         """
         ツイートのバリデーション。
+        コストの低いチェックから順に評価し、不合格が確定した時点で返す
+        （リトライ時に多い文字数超過では、以降の走査を一切行わない）。
 
         Returns:
             (is_valid, issue_description)
@@ -395,17 +836,17 @@ class ContentEngine:
         if "#" in text or "＃" in text:
             return False, "ハッシュタグが含まれています"
 
-        # 禁止表現チェック
-        for expr in BANNED_EXPRESSIONS:
-            if expr in text:
-                return False, f"禁止表現「{expr}」が含まれています"
-
-        # URLチェック
-        if re.search(r"https?://", text):
-            return False, "URLが含まれています"
-
         # メンションチェック
         if "@" in text:
             return False, "メンションが含まれています"
 
+        # URLチェック（"://" を含む場合のみ正規表現で確認）
+        if "://" in text and _URL_RE.search(text):
+            return False, "URLが含まれています"
+
+        # 禁止表現チェック（最も重い走査なので最後に行う）
+        banned = _find_banned_expression(text)
+        if banned:
+            return False, f"禁止表現「{banned}」が含まれています"
+
         return True, ""
@@ -1,12 +1,54 @@
+import copy
 import os
-import json
 import logging
 import time
+from collections import deque
 from datetime import datetime, timedelta
 from typing import List, Optional
 
+from src.storage import ensure_data_dir, load_json, save_json
+
+__all__ = ["EngagementHandler", "RateLimiter"]
+
 logger = logging.getLogger(__name__)
 
+# 引用済みツイートIDの保持件数（直近の分だけ残す）
+QUOTED_IDS_LIMIT = 50
+
+# いいねのペース（平均1件/秒、連続5件までは待たずに送る）
+LIKE_RATE_PER_SEC = 1.0
+LIKE_BURST = 5
+
+
+class RateLimiter:
+    """
+    トークンバケット方式のレート制限。
+    バケットにトークンが残っている間は待たずに通し、使い切った時だけ補充を待つ。
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: int = 1):
+        """
+        Args:
+            rate_per_sec: 1秒あたりに補充されるトークン数
+            capacity: バケットの容量（待たずに連続実行できる回数）
+        """
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last = time.monotonic()
+
+    def acquire(self):
+        """トークンを1つ消費する（足りなければ補充されるまで待つ）"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.rate)
+            self.tokens = 1.0
+            self.last = time.monotonic()
+        self.tokens -= 1
+
+
 class EngagementHandler:
     """エゴサ・エンゲージメント（いいね・引用RT等）を管理するクラス"""
 
@@ -17,9 +59,12 @@ class EngagementHandler:
             "AIエージェント",
             "AIツール"
         ]
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-        os.makedirs(self.data_dir, exist_ok=True)
+        self.data_dir = ensure_data_dir()
         self.state_file = os.path.join(self.data_dir, "engagement_state.json")
+        self._like_limiter = RateLimiter(LIKE_RATE_PER_SEC, capacity=LIKE_BURST)
+        # 読み込んだ状態のキャッシュ（ファイルの mtime が変わったときだけ読み直す）
+        self._state = None
+        self._state_mtime = 0
 
     def run_ego_search_and_like(self, max_per_keyword: int = 5, dry_run: bool = False):
         """キーワードで検索していいねをする"""
@@ -48,10 +93,10 @@ class EngagementHandler:
                     logger.info(f"[DRY RUN] いいね予定: ID={tweet['id']} Text={tweet['text'][:30]}...")
                     count += 1
                 else:
+                    self._like_limiter.acquire()
                     success = self.api.like_tweet(tweet["id"])
                     if success:
                         count += 1
-                        time.sleep(1)
 
             logger.info(f"キーワード「{kw}」で {count} 件にいいねしました")
 
@@ -89,10 +134,12 @@ class EngagementHandler:
             return
 
         # 引用したことがない最新のものを1件選択
-        quoted_ids = state.get("quoted_tweet_ids", [])
+        # 保存順は deque で保ち、重複判定は set で O(1) に行う
+        quoted_ids = deque(state.get("quoted_tweet_ids", []), maxlen=QUOTED_IDS_LIMIT)
+        quoted_id_set = set(quoted_ids)
         target_tweet = None
         for t in tweets:
-            if t["id"] not in quoted_ids and t.get("author_id") != self.api.user_id:
+            if t["id"] not in quoted_id_set and t.get("author_id") != self.api.user_id:
                 target_tweet = t
                 break
 
@@ -109,22 +156,33 @@ class EngagementHandler:
             if result["success"]:
                 logger.info(f"引用RT成功: ID={result['tweet_id']}")
                 quoted_ids.append(target_tweet["id"])
-                state["quoted_tweet_ids"] = quoted_ids[-50:] # 直近50件保持
+                state["quoted_tweet_ids"] = list(quoted_ids)
                 state["last_quote_time"] = datetime.now().isoformat()
                 self._save_state(state)
             else:
                 logger.error(f"引用RT失敗: {result.get('error')}")
 
     def _load_state(self) -> dict:
-        if os.path.exists(self.state_file):
+        """
+        状態ファイルを読み込む（更新時刻が前回と同じならキャッシュから返す）。
+        返すのはキャッシュの複製（quoted_tweet_ids のリストも含む）なので、
+        保存せずに変更してもキャッシュには残らない。
+        """
+        try:
+            mtime = os.stat(self.state_file).st_mtime_ns
+        except OSError:
+            return {"quoted_tweet_ids": [], "last_quote_time": None}
+        if self._state is None or mtime != self._state_mtime:
             try:
-                with open(self.state_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except:
-                pass
-        return {"quoted_tweet_ids": [], "last_quote_time": None}
+                self._state = load_json(self.state_file)
+            except (OSError, ValueError):
+                return {"quoted_tweet_ids": [], "last_quote_time": None}
+            self._state_mtime = mtime
+        return copy.deepcopy(self._state)
 
     def _save_state(self, state: dict):
-        with open(self.state_file, "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
+        """状態ファイルを保存し、書き込みに成功した内容だけをキャッシュする"""
+        save_json(self.state_file, state)
+        self._state = copy.deepcopy(state)
+        self._state_mtime = os.stat(self.state_file).st_mtime_ns
 
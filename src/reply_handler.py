@@ -1,9 +1,11 @@
-import json
+import asyncio
 import logging
 import os
 from datetime import datetime
 from typing import Optional
 
+from src.storage import ensure_data_dir, load_json, save_json
+
 logger = logging.getLogger(__name__)
 
 class ReplyHandler:
@@ -12,12 +14,20 @@ class ReplyHandler:
     def __init__(self, api_client, content_engine):
         self.api = api_client
         self.engine = content_engine
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-        os.makedirs(self.data_dir, exist_ok=True)
+        self.data_dir = ensure_data_dir()
         self.state_file = os.path.join(self.data_dir, "reply_state.json")
+        # 読み込んだ状態のキャッシュ（ファイルの mtime が変わったときだけ読み直す）
+        self._state = None
+        self._state_mtime = 0
+
+    def run(self, dry_run: bool = False, max_concurrent: int = 8):
+        """
+        メンションをチェックして返信する。
 
-    def run(self, dry_run: bool = False):
-        """メンションをチェックして返信する"""
+        Args:
+            dry_run: True の場合、実際に投稿しない
+            max_concurrent: 返信文を同時に生成する上限数
+        """
         state = self._load_state()
         last_id = state.get("last_mention_id")
 
@@ -29,25 +39,53 @@ class ReplyHandler:
             return
 
         # 古い順に処理（ID順）
-        for mention in reversed(mentions):
-            try:
-                self._process_mention(mention, dry_run)
-                # 処理に成功したらIDを更新
-                state["last_mention_id"] = mention["id"]
-                state["last_updated"] = datetime.now().isoformat()
+        ordered = list(reversed(mentions))
+
+        # 返信文の生成は互いに独立しているため並列に行い、投稿は古い順に1件ずつ行う
+        replies = asyncio.run(self._generate_replies(ordered, max_concurrent))
+
+        # 状態はメモリ上で更新し、ファイルへの書き込みはループ後に1回だけ行う
+        # （途中で例外が起きても、そこまでの進捗は finally で保存される）
+        updated = False
+        try:
+            for mention, reply_text in zip(ordered, replies):
+                try:
+                    if isinstance(reply_text, BaseException):
+                        raise reply_text
+                    self._post_reply(mention, reply_text, dry_run)
+                    # 処理に成功したらIDを更新
+                    state["last_mention_id"] = mention["id"]
+                    state["last_updated"] = datetime.now().isoformat()
+                    updated = True
+                except Exception as e:
+                    logger.error(f"メンション処理失敗 (ID: {mention['id']}): {e}")
+        finally:
+            if updated:
                 self._save_state(state)
-            except Exception as e:
-                logger.error(f"メンション処理失敗 (ID: {mention['id']}): {e}")
-
-    def _process_mention(self, mention: dict, dry_run: bool):
-        """個別のメンションに対して返信を生成・投稿する"""
-        logger.info(f"返信生成中: @{mention['author_username']} の投稿「{mention['text'][:30]}...」")
-        
-        reply_text = self.engine.generate_reply(
-            mention_text=mention["text"],
-            author_username=mention["author_username"]
-        )
 
+    async def _generate_replies(self, mentions: list[dict], max_concurrent: int) -> list:
+        """
+        メンションごとの返信文を並列に生成する。
+
+        Returns:
+            mentions と同じ順序の返信テキスト（失敗した位置には例外オブジェクト）
+        """
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+        async def generate(mention: dict) -> str:
+            async with semaphore:
+                logger.info(f"返信生成中: @{mention['author_username']} の投稿「{mention['text'][:30]}...」")
+                return await self.engine.agenerate_reply(
+                    mention_text=mention["text"],
+                    author_username=mention["author_username"]
+                )
+
+        # 非同期クライアントはこの asyncio.run の中だけで使い、終わったら閉じる
+        async with self.engine.async_session():
+            return await asyncio.gather(*(generate(m) for m in mentions), return_exceptions=True)
+
+    def _post_reply(self, mention: dict, reply_text: str, dry_run: bool):
+        """生成済みの返信をメンションに対して投稿する"""
         if dry_run:
             logger.info(f"[DRY RUN] 返信投稿: {reply_text}")
         else:
@@ -58,14 +96,25 @@ class ReplyHandler:
                 raise Exception(result.get("error", "Unknown error"))
 
     def _load_state(self) -> dict:
-        if os.path.exists(self.state_file):
+        """
+        状態ファイルを読み込む（更新時刻が前回と同じならキャッシュから返す）。
+        返すのはキャッシュの複製（値はスカラーだけなので浅い複製で足りる）なので、
+        保存せずに変更してもキャッシュには残らない。
+        """
+        try:
+            mtime = os.stat(self.state_file).st_mtime_ns
+        except OSError:
+            return {"last_mention_id": None}
+        if self._state is None or mtime != self._state_mtime:
             try:
-                with open(self.state_file, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except:
-                pass
-        return {"last_mention_id": None}
+                self._state = load_json(self.state_file)
+            except (OSError, ValueError):
+                return {"last_mention_id": None}
+            self._state_mtime = mtime
+        return dict(self._state)
 
     def _save_state(self, state: dict):
-        with open(self.state_file, "w", encoding="utf-8") as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
+        """状態ファイルを保存し、書き込みに成功した内容だけをキャッシュする"""
+        save_json(self.state_file, state)
+        self._state = dict(state)
+        self._state_mtime = os.stat(self.state_file).st_mtime_ns
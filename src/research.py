@@ -5,12 +5,17 @@ Research Module - バズ投稿のリサーチ・分析モジュール
 指定ジャンルでバズっている投稿を取得・分析し、構造パターンを抽出する。
 """
 
-import json
+import heapq
 import logging
 import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional
 
+from src.storage import ensure_data_dir, load_json, save_json
+
 logger = logging.getLogger(__name__)
 
 # リサーチ対象ジャンルとキーワード
@@ -48,6 +53,24 @@ RESEARCH_GENRES = {
 # バズの基準（最低いいね数）
 BUZZ_THRESHOLD_LIKES = 100
 
+# 同時に実行する検索リクエストの上限（全ジャンル合計）。
+# 検索は1つの tweepy.Client を共有する。Client はリクエストごとの可変状態を持たず、
+# 接続は requests / urllib3 のスレッドセーフな接続プールから取るので、ロックで
+# 直列化はしない。代わりに同時実行数を小さく抑え、レート制限に一度に
+# ぶつからないようにしている
+SEARCH_MAX_WORKERS = 4
+
+# 構造パターン判定用のマーカー語。1回の走査で出現したグループをまとめて拾う。
+# 各グループを先読みに包み、幅0で1文字ずつ進めることで、重なったマーカー
+# （「しかしかない」の「しかし」と「しかない」など）も取りこぼさない。
+# 同じ位置から始まるマーカーはグループ間で重ならないので、選択は1つで足りる
+_PATTERN_MARKERS_RE = re.compile(
+    r"(?=(?P<assertive>べき|しかない|それだけ))"
+    r"|(?=(?P<list>[①②１２・]))"
+    r"|(?=(?P<contrast>しかし|でも|一方で|ところが))"
+    r"|(?=(?P<experience>私は|僕は|実際に|経験上))"
+)
+
 
 class ResearchModule:
     """バズ投稿のリサーチ・分析"""
@@ -58,16 +81,19 @@ class ResearchModule:
             api_client: XAPIClient インスタンス
         """
         self.api = api_client
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-        os.makedirs(self.data_dir, exist_ok=True)
+        self.data_dir = ensure_data_dir()
 
-    def research_genre(self, genre: str, max_per_keyword: int = 10) -> list[dict]:
+    def research_genre(
+        self, genre: str, max_per_keyword: int = 10, max_workers: int = SEARCH_MAX_WORKERS
+    ) -> list[dict]:
         """
         指定ジャンルのバズ投稿をリサーチする。
+        キーワードごとの検索は互いに独立しているため、スレッドで並列に行う。
 
         Args:
             genre: ジャンル名（RESEARCH_GENRES のキー）
             max_per_keyword: キーワードごとの最大取得件数
+            max_workers: 同時に実行する検索リクエストの上限数
 
         Returns:
             バズ投稿のリスト
@@ -77,41 +103,60 @@ class ResearchModule:
             logger.warning(f"未定義のジャンル: {genre}")
             return []
 
-        all_tweets = []
-        for keyword in keywords:
-            # RT・リプライを除外し、日本語のみを検索
-            query = f"{keyword} lang:ja -is:retweet -is:reply"
-            tweets = self.api.search_tweets(query=query, max_results=max_per_keyword)
-            all_tweets.extend(tweets)
-            logger.info(f"[{genre}] '{keyword}' → {len(tweets)} 件取得")
-
-        # バズ基準を満たすもののみ抽出
-        buzz_tweets = [
-            t for t in all_tweets if t.get("like_count", 0) >= BUZZ_THRESHOLD_LIKES
-        ]
+        # map は完了順ではなくキーワード順に結果を返すので、重複除去の結果も逐次実行時と変わらない
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(keywords))) as executor:
+            tweet_lists = list(
+                executor.map(lambda kw: self._search_keyword(genre, kw, max_per_keyword), keywords)
+            )
+        return self._extract_buzz(genre, tweet_lists)
+
+    def research_all_genres(
+        self, max_per_keyword: int = 10, max_workers: int = SEARCH_MAX_WORKERS
+    ) -> list[dict]:
+        """
+        全ジャンルをリサーチする。
+        全ジャンルの (ジャンル, キーワード) を1つのスレッドプールに流し、
+        同時に飛ぶ検索リクエストを全体で max_workers 件までに抑える。
+        """
+        pairs = [(genre, kw) for genre, keywords in RESEARCH_GENRES.items() for kw in keywords]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pairs))) as executor:
+            tweet_lists = list(
+                executor.map(lambda pair: self._search_keyword(*pair, max_per_keyword), pairs)
+            )
+
+        # 結果は pairs と同じ順に並ぶので、ジャンルごとの区切りで切り出す
+        all_results = []
+        start = 0
+        for genre, keywords in RESEARCH_GENRES.items():
+            end = start + len(keywords)
+            all_results.extend(self._extract_buzz(genre, tweet_lists[start:end]))
+            start = end
+        return all_results
 
-        # 重複除去（IDベース）
-        seen_ids = set()
-        unique_tweets = []
-        for t in buzz_tweets:
-            if t["id"] not in seen_ids:
-                seen_ids.add(t["id"])
-                t["genre"] = genre
-                unique_tweets.append(t)
+    def _search_keyword(self, genre: str, keyword: str, max_per_keyword: int) -> list[dict]:
+        """1キーワード分の検索（RT・リプライを除外し、日本語のみ）"""
+        query = f"{keyword} lang:ja -is:retweet -is:reply"
+        tweets = self.api.search_tweets(query=query, max_results=max_per_keyword)
+        logger.info(f"[{genre}] '{keyword}' → {len(tweets)} 件取得")
+        return tweets
+
+    def _extract_buzz(self, genre: str, tweet_lists: list[list[dict]]) -> list[dict]:
+        """キーワード順の検索結果から、バズ基準を満たす投稿を重複なく取り出す"""
+        # バズ基準の抽出と重複除去（IDベース）を1回の走査で行う
+        # dict は挿入順を保持するため、取得順もそのまま残る
+        unique = {}
+        for tweets in tweet_lists:
+            for t in tweets:
+                if t.get("like_count", 0) >= BUZZ_THRESHOLD_LIKES and t["id"] not in unique:
+                    t["genre"] = genre
+                    unique[t["id"]] = t
+        unique_tweets = list(unique.values())
 
         logger.info(
             f"[{genre}] バズ投稿 {len(unique_tweets)} 件抽出（閾値: {BUZZ_THRESHOLD_LIKES}いいね）"
         )
         return unique_tweets
 
-    def research_all_genres(self) -> list[dict]:
-        """全ジャンルをリサーチする"""
-        all_results = []
-        for genre in RESEARCH_GENRES:
-            results = self.research_genre(genre)
-            all_results.extend(results)
-        return all_results
-
     def analyze_buzz_patterns(self, tweets: list[dict]) -> dict:
         """
         バズ投稿の構造パターンを分析する。
@@ -125,40 +170,31 @@ class ResearchModule:
         if not tweets:
             return {"patterns": [], "avg_length": 0, "top_tweets": []}
 
-        # テキスト長の分析
-        lengths = [len(t["text"]) for t in tweets]
-        avg_length = sum(lengths) / len(lengths)
-
-        # 構造パターンの抽出
-        patterns = []
+        # テキスト長の分析と構造パターンの集計を1回の走査で行う
+        total_length = 0
+        pattern_counts = Counter()
         for tweet in tweets:
             text = tweet["text"]
+            total_length += len(text)
             pattern = self._detect_pattern(text)
             if pattern:
-                patterns.append(pattern)
+                pattern_counts[pattern] += 1
+        avg_length = total_length / len(tweets)
 
-        # パターンの集計
-        pattern_counts = {}
-        for p in patterns:
-            pattern_counts[p] = pattern_counts.get(p, 0) + 1
-
-        sorted_patterns = sorted(pattern_counts.items(), key=lambda x: x[1], reverse=True)
-
-        # トップバズ投稿
-        top_tweets = sorted(
-            tweets, key=lambda x: x.get("like_count", 0), reverse=True
-        )[:10]
+        # 上位パターン・トップバズ投稿は全件ソートせずヒープで上位だけ取り出す
+        top_patterns = pattern_counts.most_common(5)
+        top_tweets = heapq.nlargest(10, tweets, key=lambda x: x.get("like_count", 0))
 
         analysis = {
             "total_analyzed": len(tweets),
             "avg_length": round(avg_length, 1),
-            "patterns": sorted_patterns[:5],
+            "patterns": top_patterns,
             "top_tweets": [
                 {"text": t["text"], "likes": t.get("like_count", 0)} for t in top_tweets
             ],
         }
 
-        logger.info(f"バズパターン分析完了: {len(tweets)} 件 → {len(sorted_patterns)} パターン")
+        logger.info(f"バズパターン分析完了: {len(tweets)} 件 → {len(pattern_counts)} パターン")
         return analysis
 
     def _detect_pattern(self, text: str) -> Optional[str]:
@@ -166,20 +202,24 @@ class ResearchModule:
         # 問いかけ型
         if text.endswith("？") or text.endswith("?"):
             return "問いかけ型"
+
+        found = {m.lastgroup for m in _PATTERN_MARKERS_RE.finditer(text)}
+        ends_with_period = text.endswith("。")
+
         # 断言型
-        if text.endswith("。") and any(w in text for w in ["べき", "しかない", "それだけ"]):
+        if ends_with_period and "assertive" in found:
             return "断言型"
         # リスト型
-        if any(c in text for c in ["①", "②", "１", "２", "・"]):
+        if "list" in found:
             return "リスト型"
         # 対比型
-        if any(w in text for w in ["しかし", "でも", "一方で", "ところが"]):
+        if "contrast" in found:
             return "対比型"
         # 体験型
-        if any(w in text for w in ["私は", "僕は", "実際に", "経験上"]):
+        if "experience" in found:
             return "体験型"
         # 格言型
-        if len(text) < 60 and text.endswith("。"):
+        if len(text) < 60 and ends_with_period:
             return "格言型"
         return "その他"
 
@@ -191,8 +231,7 @@ class ResearchModule:
             "total_count": len(results),
             "tweets": results,
         }
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        save_json(filepath, data)
         logger.info(f"リサーチ結果保存: {filepath}")
 
     def load_research_results(self, filename: str = "research_results.json") -> list[dict]:
@@ -201,8 +240,7 @@ class ResearchModule:
         if not os.path.exists(filepath):
             logger.warning(f"リサーチ結果ファイルなし: {filepath}")
             return []
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_json(filepath)
         return data.get("tweets", [])
 
     def get_sample_buzz_tweets(self) -> list[dict]:
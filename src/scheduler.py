@@ -3,31 +3,56 @@ Scheduler - 予約投稿の時間分散管理モジュール
 1日10件の投稿をピークタイムに分散配置して実行する。
 """
 
-import json
+import asyncio
+import heapq
 import logging
 import os
-import time
-from datetime import datetime, timedelta
-from typing import Optional
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from itertools import groupby, islice
+from typing import NamedTuple, Optional
+
+from src.storage import append_jsonl, ensure_data_dir, load_json, save_json
 
 logger = logging.getLogger(__name__)
 
+# デーモンの最大待機秒数。別プロセス（--generate 等）がファイルに追加した予約も
+# この間隔で拾えるよう、次の予約時刻が遠くても最大でこの秒数ごとに起きる
+DAEMON_POLL_SECONDS = 60
+
+
+class PeakSlot(NamedTuple):
+    """ピークタイムスロット（時・分は割り当てのたびにパースしないよう数値で持つ）"""
+
+    hour: int
+    minute: int
+    period: str
+
+
 # ピークタイムスロット（JST）
 # 朝3件、昼3件、夜4件 = 計10件
 PEAK_SLOTS = [
-    {"time": "07:00", "period": "morning"},
-    {"time": "08:00", "period": "morning"},
-    {"time": "09:00", "period": "morning"},
-    {"time": "12:00", "period": "noon"},
-    {"time": "12:30", "period": "noon"},
-    {"time": "13:00", "period": "noon"},
-    {"time": "20:00", "period": "evening"},
-    {"time": "21:00", "period": "evening"},
-    {"time": "22:00", "period": "evening"},
-    {"time": "23:00", "period": "evening"},
+    PeakSlot(7, 0, "morning"),
+    PeakSlot(8, 0, "morning"),
+    PeakSlot(9, 0, "morning"),
+    PeakSlot(12, 0, "noon"),
+    PeakSlot(12, 30, "noon"),
+    PeakSlot(13, 0, "noon"),
+    PeakSlot(20, 0, "evening"),
+    PeakSlot(21, 0, "evening"),
+    PeakSlot(22, 0, "evening"),
+    PeakSlot(23, 0, "evening"),
 ]
 
 
+@lru_cache(maxsize=1024)
+def _parse_scheduled_time(value: str) -> datetime:
+    """予約時刻の文字列を datetime に変換する（同じ文字列は毎回パースしない）"""
+    return datetime.fromisoformat(value)
+
+
 class PostScheduler:
     """予約投稿の時間分散管理"""
 
@@ -37,10 +62,14 @@ class PostScheduler:
             api_client: XAPIClient インスタンス（Noneの場合はドライラン）
         """
         self.api = api_client
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-        os.makedirs(self.data_dir, exist_ok=True)
+        self.data_dir = ensure_data_dir()
         self.scheduled_file = os.path.join(self.data_dir, "scheduled.json")
-        self.history_file = os.path.join(self.data_dir, "post_history.json")
+        # 投稿履歴は追記専用の JSON Lines（旧形式の post_history.json は初回追記時に移行する）
+        self.history_file = os.path.join(self.data_dir, "post_history.jsonl")
+        # 直近に読み込み・保存したスケジュールと、そのときのファイル更新時刻
+        # （呼び出し側には複製を渡すので、ここは _load/_save_scheduled からしか触らない）
+        self._scheduled: Optional[list[dict]] = None
+        self._scheduled_mtime = 0
 
     def stock_tweets(self, tweets: list[str]):
         """
@@ -49,26 +78,43 @@ class PostScheduler:
         Args:
             tweets: ツイートテキストのリスト
         """
-        existing = self._load_scheduled()
-
-        for tweet in tweets:
-            existing.append(
-                {
-                    "text": tweet,
-                    "status": "pending",
-                    "created_at": datetime.now().isoformat(),
-                    "posted_at": None,
-                }
-            )
+        with self.edit_scheduled() as existing:
+            existing.extend(self.make_stock_items(tweets))
 
-        self._save_scheduled(existing)
         logger.info(f"ツイート {len(tweets)} 件をストックに追加（合計: {len(existing)} 件）")
 
+    def make_stock_items(self, tweets: list[str]) -> list[dict]:
+        """ツイートテキストから未投稿（pending）のストック項目を作成"""
+        # 同じ呼び出しで作る項目は作成時刻を共有する
+        created_at = datetime.now().isoformat()
+        return [
+            {
+                "text": tweet,
+                "status": "pending",
+                "created_at": created_at,
+                "posted_at": None,
+            }
+            for tweet in tweets
+        ]
+
+    @contextmanager
+    def edit_scheduled(self):
+        """
+        スケジュールを「1回の読み込み・1回の保存」で編集するコンテキストマネージャ。
+        ブロック内で例外が発生した場合は保存しない。
+
+        Yields:
+            スケジュール全件のリスト（直接変更してよい）
+        """
+        data = self._load_scheduled()
+        yield data
+        self._save_scheduled(data)
+
     def get_pending_tweets(self, count: int = 10) -> list[dict]:
         """未投稿のツイートを取得"""
         scheduled = self._load_scheduled()
-        pending = [s for s in scheduled if s["status"] == "pending"]
-        return pending[:count]
+        # 先頭から count 件見つかった時点で走査をやめる
+        return list(islice((s for s in scheduled if s["status"] == "pending"), count))
 
     def assign_time_slots(self, tweets: list[dict]) -> list[dict]:
         """
@@ -80,21 +126,17 @@ class PostScheduler:
         Returns:
             タイムスロットが割り当てられたリスト
         """
-        today = datetime.now().date()
-        slots = PEAK_SLOTS[: len(tweets)]
-
-        for i, tweet in enumerate(tweets):
-            if i < len(slots):
-                slot = slots[i]
-                hour, minute = map(int, slot["time"].split(":"))
-                scheduled_time = datetime.combine(
-                    today, datetime.min.time().replace(hour=hour, minute=minute)
-                )
-                # 既に過ぎた時間は翌日に設定
-                if scheduled_time <= datetime.now():
-                    scheduled_time += timedelta(days=1)
-                tweet["scheduled_time"] = scheduled_time.isoformat()
-                tweet["period"] = slot["period"]
+        now = datetime.now()
+        today = now.date()
+
+        # スロット数を超えた分は割り当てない
+        for tweet, (hour, minute, period) in zip(tweets, PEAK_SLOTS):
+            scheduled_time = datetime.combine(today, time(hour, minute))
+            # 既に過ぎた時間は翌日に設定
+            if scheduled_time <= now:
+                scheduled_time += timedelta(days=1)
+            tweet["scheduled_time"] = scheduled_time.isoformat()
+            tweet["period"] = period
 
         return tweets
 
@@ -110,44 +152,123 @@ class PostScheduler:
         """
         scheduled = self._load_scheduled()
         now = datetime.now()
+        now_iso = now.isoformat()
         results = []
 
-        for item in scheduled:
-            if item["status"] != "pending":
-                continue
-            if "scheduled_time" not in item:
-                continue
-
-            scheduled_time = datetime.fromisoformat(item["scheduled_time"])
-            if scheduled_time <= now:
-                if dry_run:
-                    logger.info(f"[DRY RUN] 投稿: {item['text'][:50]}...")
-                    item["status"] = "dry_run"
-                    results.append({"text": item["text"], "result": "dry_run"})
+        due, changed = self._pop_due(scheduled, now)
+        for item in due:
+            if dry_run:
+                logger.info(f"[DRY RUN] 投稿: {item['text'][:50]}...")
+                item["status"] = "dry_run"
+                results.append({"text": item["text"], "result": "dry_run"})
+            else:
+                if self.api:
+                    result = self.api.post_tweet(item["text"])
+                    self._apply_post_result(item, result, now_iso)
+                    results.append({"text": item["text"], "result": result})
                 else:
-                    if self.api:
-                        result = self.api.post_tweet(item["text"])
-                        if result["success"]:
-                            item["status"] = "posted"
-                            item["posted_at"] = now.isoformat()
-                            item["tweet_id"] = result["tweet_id"]
-                            logger.info(f"投稿完了: {item['text'][:50]}...")
-                        else:
-                            item["status"] = "failed"
-                            item["error"] = result["error"]
-                            logger.error(f"投稿失敗: {result['error']}")
-                        results.append({"text": item["text"], "result": result})
-                    else:
-                        logger.warning("APIクライアントが設定されていません。")
-                        item["status"] = "no_api"
-
-        self._save_scheduled(scheduled)
+                    logger.warning("APIクライアントが設定されていません。")
+                    item["status"] = "no_api"
+
+        # 何も変わらなければ書き込まない
+        if changed:
+            self._save_scheduled(scheduled)
+        self._update_history(results)
+        return results
+
+    async def execute_scheduled_async(self, dry_run: bool = False) -> list[dict]:
+        """
+        時間が来た予約投稿を実行する（execute_scheduled の非同期版）。
+        投稿順は同期版と同じく予約時刻の早い順に保つ。予約時刻が同じ項目どうしには
+        順序の決まりがないので、それらだけは投稿のHTTPリクエストを重ねて同時に待つ。
+
+        Args:
+            dry_run: True の場合、実際に投稿しない
+
+        Returns:
+            実行結果のリスト
+        """
+        if dry_run or not self.api:
+            return self.execute_scheduled(dry_run=dry_run)
+
+        scheduled = self._load_scheduled()
+        now = datetime.now()
+        now_iso = now.isoformat()
+        due, changed = self._pop_due(scheduled, now)
+
+        # tweepy のクライアントは同期APIなので、1件ずつワーカースレッドで投稿する。
+        # due は予約時刻順なので、同じ時刻のまとまりごとに順に投稿する
+        outcomes = []
+        for _, group in groupby(due, key=lambda item: _parse_scheduled_time(item["scheduled_time"])):
+            outcomes.extend(await asyncio.gather(
+                *(asyncio.to_thread(self.api.post_tweet, item["text"]) for item in group),
+                return_exceptions=True,
+            ))
+
+        results = []
+        for item, result in zip(due, outcomes):
+            if isinstance(result, Exception):
+                result = {"success": False, "error": str(result), "text": item["text"]}
+            self._apply_post_result(item, result, now_iso)
+            results.append({"text": item["text"], "result": result})
+
+        if changed:
+            self._save_scheduled(scheduled)
         self._update_history(results)
         return results
 
+    def _pop_due(self, scheduled: list[dict], now: datetime) -> tuple[list[dict], bool]:
+        """
+        予約時刻の早い順に、時間が来たものだけをヒープから取り出す。
+        予約時刻を解釈できない項目は投稿せず failed にする。
+
+        Returns:
+            (時間が来た項目のリスト, スケジュールを変更したか)
+        """
+        due_heap, invalid = self._build_due_heap(scheduled)
+        for item in invalid:
+            item["status"] = "failed"
+            item["error"] = f"予約時刻を解釈できません: {item['scheduled_time']!r}"
+            logger.error(f"{item['error']} ({item['text'][:30]}...)")
+
+        due = []
+        while due_heap and due_heap[0][0] <= now:
+            _, i = heapq.heappop(due_heap)
+            due.append(scheduled[i])
+        # 取り出した予約は必ずステータスが変わる
+        return due, bool(due or invalid)
+
+    def _apply_post_result(self, item: dict, result: dict, posted_at: str):
+        """投稿結果を予約アイテムに反映する"""
+        if result["success"]:
+            item["status"] = "posted"
+            item["posted_at"] = posted_at
+            item["tweet_id"] = result["tweet_id"]
+            logger.info(f"投稿完了: {item['text'][:50]}...")
+        else:
+            item["status"] = "failed"
+            item["error"] = result["error"]
+            logger.error(f"投稿失敗: {result['error']}")
+
     def run_daemon(self, dry_run: bool = False):
+        """
+        デーモンモードで予約投稿を監視・実行する（arun_daemon の同期ラッパー）。
+
+        Args:
+            dry_run: ドライランモード
+        """
+        try:
+            asyncio.run(self.arun_daemon(dry_run=dry_run))
+        except KeyboardInterrupt:
+            logger.info("スケジューラーデーモン停止")
+
+    async def arun_daemon(self, dry_run: bool = False):
         """
         デーモンモードで予約投稿を監視・実行する。
+        1分ごとに固定で起きるのではなく、次の予約時刻まで待機する。
+        別プロセス（--generate など）で追加された予約は、最大 DAEMON_POLL_SECONDS ごとの
+        定期確認でファイルから読み直して拾う。定期確認は単調時計上の絶対時刻で刻むので、
+        投稿処理にかかった時間のぶん周期が後ろにずれていくことはない。
 
         Args:
             dry_run: ドライランモード
@@ -155,31 +276,41 @@ class PostScheduler:
         logger.info("スケジューラーデーモン起動...")
         logger.info(f"ドライラン: {'ON' if dry_run else 'OFF'}")
 
-        try:
-            while True:
-                self.execute_scheduled(dry_run=dry_run)
-                time.sleep(60)  # 1分ごとにチェック
-        except KeyboardInterrupt:
-            logger.info("スケジューラーデーモン停止")
+        loop = asyncio.get_running_loop()
+        next_poll = loop.time()
+        while True:
+            await self.execute_scheduled_async(dry_run=dry_run)
+
+            now = loop.time()
+            while next_poll <= now:
+                next_poll += DAEMON_POLL_SECONDS
+            await asyncio.sleep(self._seconds_until_next_due(limit=next_poll - now))
+
+    def _seconds_until_next_due(self, limit: float = DAEMON_POLL_SECONDS) -> float:
+        """次の予約投稿までの秒数（最大 limit 秒）"""
+        due_heap, _ = self._build_due_heap(self._load_scheduled())
+        if not due_heap:
+            return float(limit)
+        delta = (due_heap[0][0] - datetime.now()).total_seconds()
+        return min(float(limit), max(0.0, delta))
 
     def get_schedule_summary(self) -> str:
         """現在のスケジュール状況を要約テキストで返す"""
         scheduled = self._load_scheduled()
-        pending = [s for s in scheduled if s["status"] == "pending"]
-        posted = [s for s in scheduled if s["status"] == "posted"]
-        failed = [s for s in scheduled if s["status"] == "failed"]
+        # ステータスごとの件数は1回の走査で集計する
+        status_counts = Counter(s["status"] for s in scheduled)
 
         lines = [
             f"📊 スケジュール状況",
-            f"  待機中: {len(pending)} 件",
-            f"  投稿済: {len(posted)} 件",
-            f"  失敗:   {len(failed)} 件",
+            f"  待機中: {status_counts['pending']} 件",
+            f"  投稿済: {status_counts['posted']} 件",
+            f"  失敗:   {status_counts['failed']} 件",
             f"  合計:   {len(scheduled)} 件",
         ]
 
-        if pending:
+        if status_counts["pending"]:
             lines.append("\n⏰ 次の予約投稿:")
-            for item in pending[:3]:
+            for item in islice((s for s in scheduled if s["status"] == "pending"), 3):
                 t = item.get("scheduled_time", "未設定")
                 lines.append(f"  {t}: {item['text'][:40]}...")
 
@@ -194,32 +325,72 @@ class PostScheduler:
         logger.info(f"投稿済み {cleared} 件をクリア")
 
     def _load_scheduled(self) -> list[dict]:
-        """スケジュールファイルを読み込み"""
-        if not os.path.exists(self.scheduled_file):
+        """
+        スケジュールファイルを読み込む。
+        ファイルが前回の読み込み・保存から変わっていなければパースせずキャッシュから返す。
+        返すのは各項目の複製なので、保存せずに変更してもキャッシュには影響しない。
+        """
+        try:
+            mtime = os.stat(self.scheduled_file).st_mtime_ns
+        except OSError:
+            self._scheduled = None
             return []
-        with open(self.scheduled_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        if self._scheduled is None or mtime != self._scheduled_mtime:
+            self._scheduled = load_json(self.scheduled_file)
+            self._scheduled_mtime = mtime
+        # 項目の値は文字列や None だけなので、浅い複製で足りる
+        return [dict(item) for item in self._scheduled]
 
     def _save_scheduled(self, data: list[dict]):
-        """スケジュールファイルを保存"""
-        with open(self.scheduled_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        """スケジュールファイルを保存（キャッシュも保存した内容に更新する）"""
+        save_json(self.scheduled_file, data)
+        self._scheduled = [dict(item) for item in data]
+        self._scheduled_mtime = os.stat(self.scheduled_file).st_mtime_ns
+
+    def _build_due_heap(self, data: list[dict]) -> tuple[list[tuple[datetime, int]], list[dict]]:
+        """
+        待機中かつ予約時刻のある項目の (予約時刻, インデックス) ヒープを作る。
+        予約時刻を解釈できない項目はヒープに入れず、1件の不正で全体を止めない。
+
+        Returns:
+            (ヒープ, 予約時刻が不正な項目のリスト)
+        """
+        heap = []
+        invalid = []
+        for i, item in enumerate(data):
+            if item["status"] != "pending" or "scheduled_time" not in item:
+                continue
+            try:
+                heap.append((_parse_scheduled_time(item["scheduled_time"]), i))
+            except (TypeError, ValueError):
+                invalid.append(item)
+        heapq.heapify(heap)
+        return heap, invalid
 
     def _update_history(self, results: list[dict]):
-        """投稿履歴を更新"""
-        history = []
-        if os.path.exists(self.history_file):
-            with open(self.history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-
-        for r in results:
-            history.append(
+        """投稿履歴を更新（新しい結果だけを末尾に追記する）"""
+        if not results:
+            return
+        self._migrate_legacy_history()
+
+        timestamp = datetime.now().isoformat()
+        append_jsonl(
+            self.history_file,
+            [
                 {
                     "text": r["text"],
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": timestamp,
                     "result": str(r.get("result", "")),
                 }
-            )
-
-        with open(self.history_file, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+                for r in results
+            ],
+        )
+
+    def _migrate_legacy_history(self):
+        """旧形式（JSON配列）の post_history.json があれば JSON Lines に移行する"""
+        legacy_file = os.path.splitext(self.history_file)[0] + ".json"
+        if not os.path.exists(legacy_file) or os.path.exists(self.history_file):
+            return
+        append_jsonl(self.history_file, load_json(legacy_file))
+        os.remove(legacy_file)
+        logger.info(f"投稿履歴を JSON Lines 形式に移行: {self.history_file}")
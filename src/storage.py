@@ -0,0 +1,99 @@
+"""
+Storage - JSONファイルの読み書きユーティリティ
+orjson がインストールされていれば C 実装で高速に読み書きし、
+なければ標準ライブラリの json にフォールバックする。
+"""
+
+import json
+import mmap
+import os
+from functools import cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# このサイズ以上のファイルは mmap で読み、ページキャッシュから直接デコードする
+# （小さいファイルでは mmap の準備のほうが高くつくため通常の read を使う）
+MMAP_THRESHOLD = 1 << 20
+
+# 各モジュールが状態・キャッシュを置くデータディレクトリ（リポジトリ直下の data/）
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@cache
+def ensure_data_dir() -> str:
+    """
+    データディレクトリを作成してパスを返す。
+    作成確認はプロセス内で1回だけ行い、2回目以降はパスを返すだけにする。
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return DATA_DIR
+
+
+def load_json(path: "str | os.PathLike"):
+    """
+    JSONファイルを読み込む。
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        デコードされたオブジェクト
+    """
+    with open(path, "rb") as f:
+        if orjson is not None and os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            # 読み込み用のバッファへコピーせず、マップした領域をそのまま orjson に渡す
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def save_json(path: "str | os.PathLike", data, pretty: bool = True) -> None:
+    """
+    JSONファイルを保存する（UTF-8）。
+    一時ファイルに書き出してから置き換えるため、書き込み途中で中断されても
+    既存のファイルが壊れることはない。
+
+    Args:
+        path: ファイルパス
+        data: 保存するオブジェクト
+        pretty: True ならインデント2で整形、False なら区切りの空白も省いた最小形式
+                （プログラムからしか読まないキャッシュ向け）
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        payload = orjson.dumps(data, option=option)
+    elif pretty:
+        payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    else:
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def append_jsonl(path: "str | os.PathLike", records: list) -> None:
+    """
+    JSON Lines 形式（1行1オブジェクト）でファイル末尾に追記する。
+    既存の内容は読み込まないので、追記1回のコストは追記件数にだけ比例する。
+
+    Args:
+        path: ファイルパス
+        records: 追記するオブジェクトのリスト
+    """
+    if orjson is not None:
+        payload = b"".join(orjson.dumps(r, option=orjson.OPT_NON_STR_KEYS) + b"\n" for r in records)
+    else:
+        payload = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records).encode("utf-8")
+    with open(path, "ab") as f:
+        f.write(payload)
+
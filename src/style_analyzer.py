@@ -3,23 +3,168 @@ Style Analyzer - 過去ツイートのスタイル分析モジュール
 語尾パターン、漢字/ひらがな比率、口癖、リズムパターンを分析する。
 """
 
+import heapq
 import json
 import logging
 import os
 import re
 import unicodedata
+from bisect import bisect_left, bisect_right
 from collections import Counter
+from functools import lru_cache
+from types import MappingProxyType
 from typing import Optional
 
+from src.storage import ensure_data_dir
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+# 文末パターン（先に並んだものほど優先）
+ENDING_LABELS = [
+    "である", "だ", "です", "ます", "だろう",
+    "ない", "する", "こと", "もの", "たい",
+    "べきだ", "しかない", "のだ", "いる", "れる",
+]
+# 全パターンを1つの選択パターンにまとめ、1回の search で文末を判定する。
+# 正規表現は左端の一致を返すため、先に並んだ語尾で終わる語尾（べきだ・のだ → だ、
+# しかない → ない）を含めると優先順位が逆転する。それらは元々選ばれることがないので除外する
+_ENDING_RE = re.compile(
+    "("
+    + "|".join(
+        re.escape(label)
+        for i, label in enumerate(ENDING_LABELS)
+        if not any(label.endswith(prev) for prev in ENDING_LABELS[:i])
+    )
+    + ")。?$"
+)
+_SENTENCE_SPLIT_RE = re.compile(r"[。！？\n]")
+_URL_RE = re.compile(r"https?://\S+")
+_MENTION_RE = re.compile(r"@\w+")
+_PUNCT_ONLY_RE = re.compile(r"^[。、！？\s]+$")
+
+# 口調の判定語（カテゴリ → 語のリスト）。問いかけは「？」「?」の有無で判定する
+TONE_WORDS = {
+    "assertive": ["べき", "しかない", "絶対", "確実に"],  # 断定的
+    "reflective": ["思う", "感じる", "気づいた", "考える"],  # 内省的
+    "instructive": ["すべき", "してほしい", "おすすめ", "大切"],  # 教え
+}
+# pyahocorasick があれば全カテゴリの語を1つのオートマトンにまとめ、1回の走査で判定する
+# （「すべき」と「べき」のように重なる語もそれぞれ検出される）
+if ahocorasick is not None:
+    _TONE_AUTOMATON = ahocorasick.Automaton()
+    for _category, _words in TONE_WORDS.items():
+        for _word in _words:
+            _TONE_AUTOMATON.add_word(_word, _category)
+    _TONE_AUTOMATON.make_automaton()
+else:
+    _TONE_AUTOMATON = None
+
+
+def _tone_categories(text: str) -> set[str]:
+    """テキストに判定語が含まれる口調カテゴリの集合を返す"""
+    if _TONE_AUTOMATON is not None:
+        return {category for _, category in _TONE_AUTOMATON.iter(text)}
+    return {
+        category
+        for category, words in TONE_WORDS.items()
+        if any(w in text for w in words)
+    }
+
+
+@lru_cache(maxsize=8192)
+def _char_class(char: str) -> str:
+    """文字種を判定する（"kanji" / "hiragana" / "katakana" / "other"）"""
+    name = unicodedata.name(char, "")
+    if "CJK UNIFIED IDEOGRAPH" in name:
+        return "kanji"
+    if "HIRAGANA" in name:
+        return "hiragana"
+    if "KATAKANA" in name:
+        return "katakana"
+    return "other"
+
+
+# デフォルトのスタイルプロファイル（AI戦略家・断定調）
+# フォールバックのたびに組み立てないよう、読み取り専用で1度だけ作っておく
+_DEFAULT_PROFILE = MappingProxyType({
+    "total_tweets_analyzed": 0,
+    "endings": (
+        ("だ", 0, 40.0),
+        ("である", 0, 30.0),
+        ("だろう", 0, 10.0),
+        ("ない", 0, 15.0),
+        ("する", 0, 5.0),
+    ),
+    "char_ratios": MappingProxyType({
+        "kanji_pct": 40.0,
+        "hiragana_pct": 45.0,
+        "katakana_pct": 10.0,
+        "other_pct": 5.0,
+    }),
+    "frequent_phrases": (),
+    "avg_length": 120,
+    "length_distribution": MappingProxyType({"min": 80, "max": 140, "avg": 120}),
+    "tone_markers": MappingProxyType({
+        "assertive": 60.0,
+        "questioning": 5.0,
+        "reflective": 15.0,
+        "instructive": 20.0,
+    }),
+    "note": "デフォルトプロファイル（AI戦略家・断定調）",
+})
+
+
+def _default_profile_copy() -> dict:
+    """デフォルトプロファイルを変更・保存できる通常の dict / list に戻して返す"""
+    return {
+        key: dict(value) if isinstance(value, MappingProxyType)
+        else list(value) if isinstance(value, tuple)
+        else value
+        for key, value in _DEFAULT_PROFILE.items()
+    }
+
+
+@lru_cache(maxsize=4)
+def _format_style_fragment(
+    endings: tuple, kanji_pct, hiragana_pct, dominant_tone: str, phrases: tuple, avg_length
+) -> str:
+    """
+    プロンプト用の文体ルールを整形する。
+    同じプロファイルからは毎回同じ文字列になるので、引数のタプルをキーにキャッシュする。
+    """
+    # 語尾パターンの上位
+    top_endings = [f"「{label}」({pct}%)" for label, pct in endings]
+    endings_str = "、".join(top_endings) if top_endings else "「だ」「である」調"
+
+    # 口癖
+    phrase_examples = "、".join([f"「{ph}」" for ph in phrases]) if phrases else "なし"
+
+    # トーン
+    tone_desc = {
+        "assertive": "断定的で力強い",
+        "questioning": "問いかけ型で読者に考えさせる",
+        "reflective": "内省的で落ち着いた",
+        "instructive": "教訓的でアドバイス寄り",
+    }.get(dominant_tone, "バランスの取れた")
+
+    return f"""【文体ルール】
+- 語尾パターン: {endings_str}
+- 漢字率約{kanji_pct}%、ひらがな率約{hiragana_pct}%のバランスを保つ
+- 口調は{tone_desc}トーン
+- 頻出フレーズ: {phrase_examples}
+- 平均文字数: {avg_length}文字前後"""
+
 
 class StyleAnalyzer:
     """過去ツイートのスタイル分析"""
 
     def __init__(self):
-        self.data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-        os.makedirs(self.data_dir, exist_ok=True)
+        self.data_dir = ensure_data_dir()
         self._analysis_cache: Optional[dict] = None
 
     def analyze_tweets(self, tweets: list[dict]) -> dict:
@@ -35,7 +180,8 @@ class StyleAnalyzer:
         texts = [t["text"] for t in tweets if t.get("text")]
         if not texts:
             logger.warning("分析対象ツイートがありません。")
-            return self._default_profile()
+            # 呼び出し側で保存・変更されるので、共有の定数ではなく通常の dict で返す
+            return _default_profile_copy()
 
         profile = {
             "total_tweets_analyzed": len(texts),
@@ -56,36 +202,16 @@ class StyleAnalyzer:
     def _analyze_endings(self, texts: list[str]) -> list[tuple[str, int]]:
         """語尾パターンを分析"""
         endings = []
-        # 文末パターンを抽出
-        ending_patterns = [
-            (r"である。?$", "である"),
-            (r"だ。?$", "だ"),
-            (r"です。?$", "です"),
-            (r"ます。?$", "ます"),
-            (r"だろう。?$", "だろう"),
-            (r"ない。?$", "ない"),
-            (r"する。?$", "する"),
-            (r"こと。?$", "こと"),
-            (r"もの。?$", "もの"),
-            (r"たい。?$", "たい"),
-            (r"べきだ。?$", "べきだ"),
-            (r"しかない。?$", "しかない"),
-            (r"のだ。?$", "のだ"),
-            (r"いる。?$", "いる"),
-            (r"れる。?$", "れる"),
-        ]
-
         for text in texts:
             # 文を分割して各文末を分析
-            sentences = re.split(r"[。！？\n]", text)
+            sentences = _SENTENCE_SPLIT_RE.split(text)
             for sentence in sentences:
                 sentence = sentence.strip()
                 if len(sentence) < 3:
                     continue
-                for pattern, label in ending_patterns:
-                    if re.search(pattern, sentence):
-                        endings.append(label)
-                        break
+                match = _ENDING_RE.search(sentence)
+                if match:
+                    endings.append(match.group(1))
 
         counter = Counter(endings)
         total = sum(counter.values()) or 1
@@ -96,68 +222,76 @@ class StyleAnalyzer:
 
     def _analyze_char_ratios(self, texts: list[str]) -> dict:
         """漢字/ひらがな/カタカナ/記号の比率を計算"""
-        kanji = 0
-        hiragana = 0
-        katakana = 0
-        other = 0
-        total = 0
-
-        for text in texts:
-            for char in text:
-                if char.isspace():
-                    continue
-                total += 1
-                name = unicodedata.name(char, "")
-                if "CJK UNIFIED IDEOGRAPH" in name:
-                    kanji += 1
-                elif "HIRAGANA" in name:
-                    hiragana += 1
-                elif "KATAKANA" in name:
-                    katakana += 1
-                else:
-                    other += 1
-
-        total = total or 1
+        # 文字ごとの出現数は Counter（C実装）でまとめて数え、
+        # 文字種の判定は異なる文字1種類につき1回だけ行う
+        char_counts = Counter("".join(texts))
+        counts = {"kanji": 0, "hiragana": 0, "katakana": 0, "other": 0}
+        for char, n in char_counts.items():
+            if char.isspace():
+                continue
+            counts[_char_class(char)] += n
+
+        total = sum(counts.values()) or 1
         return {
-            "kanji_pct": round(kanji / total * 100, 1),
-            "hiragana_pct": round(hiragana / total * 100, 1),
-            "katakana_pct": round(katakana / total * 100, 1),
-            "other_pct": round(other / total * 100, 1),
+            "kanji_pct": round(counts["kanji"] / total * 100, 1),
+            "hiragana_pct": round(counts["hiragana"] / total * 100, 1),
+            "katakana_pct": round(counts["katakana"] / total * 100, 1),
+            "other_pct": round(counts["other"] / total * 100, 1),
         }
 
     def _analyze_phrases(self, texts: list[str]) -> list[tuple[str, int]]:
         """頻出フレーズ（口癖）を抽出"""
-        # 2-5文字のn-gramを抽出
-        all_ngrams = []
+        # URL・メンションを含まないツイートが大半なので、部分文字列で先に判定する
+        cleans = []
         for text in texts:
-            clean = re.sub(r"https?://\S+", "", text)
-            clean = re.sub(r"@\w+", "", clean)
-            for n in range(2, 6):
-                for i in range(len(clean) - n + 1):
-                    ngram = clean[i : i + n]
-                    if not re.match(r"^[\s\u3000]+$", ngram):  # 空白のみは除外
-                        all_ngrams.append(ngram)
-
-        counter = Counter(all_ngrams)
-        # 3回以上出現するフレーズのみ
+            clean = _URL_RE.sub("", text) if "://" in text else text
+            if "@" in clean:
+                clean = _MENTION_RE.sub("", clean)
+            cleans.append(clean)
+
+        # 2-5文字のn-gramを長さごとに数え、3回未満のものはすぐ捨てる
+        # （1回しか出ない n-gram が大半なので、全長さ分を同時に抱えない）
+        levels = []
+        for n in range(2, 6):
+            level = Counter()
+            for clean in cleans:
+                level.update(clean[i : i + n] for i in range(len(clean) - n + 1))
+            # 残す n-gram には初出のツイート番号を添える。Counter は初出順に並ぶので
+            # 番号は単調に増え、前から順に探すだけで求まる
+            kept = []
+            t = 0
+            for ngram, count in level.items():
+                if count >= 3 and not ngram.isspace():  # 空白のみは除外
+                    while ngram not in cleans[t]:
+                        t += 1
+                    kept.append((t, n, ngram, count))
+            levels.append(kept)
+
+        # 全長さを1つの Counter で数えた場合と同じ初出順（ツイート、長さ、位置）に並べ直し、
+        # 同数のときの順位を従来どおりに保つ
+        counter = Counter(
+            {ngram: count for _, _, ngram, count in heapq.merge(*levels, key=lambda e: e[:2])}
+        )
         frequent = [
             (phrase, count)
             for phrase, count in counter.most_common(30)
-            if count >= 3
-            and not re.match(r"^[。、！？\s]+$", phrase)  # 句読点のみは除外
+            if not _PUNCT_ONLY_RE.match(phrase)  # 句読点のみは除外
         ]
         return frequent[:15]
 
     def _analyze_length_distribution(self, texts: list[str]) -> dict:
         """文字数の分布を分析"""
-        lengths = [len(t) for t in texts]
+        # 1回ソートしておけば、最小・最大は両端、各区間の件数は二分探索で求まる
+        lengths = sorted(len(t) for t in texts)
+        under_100 = bisect_left(lengths, 100)
+        under_70 = bisect_left(lengths, 70, hi=under_100)
         return {
-            "min": min(lengths),
-            "max": max(lengths),
+            "min": lengths[0],
+            "max": lengths[-1],
             "avg": round(sum(lengths) / len(lengths), 1),
-            "under_70": sum(1 for l in lengths if l < 70),
-            "70_to_100": sum(1 for l in lengths if 70 <= l < 100),
-            "100_to_140": sum(1 for l in lengths if 100 <= l <= 140),
+            "under_70": under_70,
+            "70_to_100": under_100 - under_70,
+            "100_to_140": bisect_right(lengths, 140, lo=under_100) - under_100,
         }
 
     def _analyze_tone(self, texts: list[str]) -> dict:
@@ -170,46 +304,17 @@ class StyleAnalyzer:
         }
 
         for text in texts:
-            if any(w in text for w in ["べき", "しかない", "絶対", "確実に"]):
-                markers["assertive"] += 1
+            for category in _tone_categories(text):
+                markers[category] += 1
             if "？" in text or "?" in text:
                 markers["questioning"] += 1
-            if any(w in text for w in ["思う", "感じる", "気づいた", "考える"]):
-                markers["reflective"] += 1
-            if any(w in text for w in ["すべき", "してほしい", "おすすめ", "大切"]):
-                markers["instructive"] += 1
 
         total = len(texts) or 1
         return {k: round(v / total * 100, 1) for k, v in markers.items()}
 
-    def _default_profile(self) -> dict:
-        """デフォルトのスタイルプロファイル（AI戦略家・断定調）"""
-        return {
-            "total_tweets_analyzed": 0,
-            "endings": [
-                ("だ", 0, 40.0),
-                ("である", 0, 30.0),
-                ("だろう", 0, 10.0),
-                ("ない", 0, 15.0),
-                ("する", 0, 5.0),
-            ],
-            "char_ratios": {
-                "kanji_pct": 40.0,
-                "hiragana_pct": 45.0,
-                "katakana_pct": 10.0,
-                "other_pct": 5.0,
-            },
-            "frequent_phrases": [],
-            "avg_length": 120,
-            "length_distribution": {"min": 80, "max": 140, "avg": 120},
-            "tone_markers": {
-                "assertive": 60.0,
-                "questioning": 5.0,
-                "reflective": 15.0,
-                "instructive": 20.0,
-            },
-            "note": "デフォルトプロファイル（AI戦略家・断定調）",
-        }
+    def _default_profile(self) -> MappingProxyType:
+        """デフォルトのスタイルプロファイル（読み取り専用。変更する場合は _default_profile_copy を使う）"""
+        return _DEFAULT_PROFILE
 
     def get_style_prompt_fragment(self, profile: Optional[dict] = None) -> str:
         """
@@ -223,35 +328,21 @@ class StyleAnalyzer:
         """
         p = profile or self._analysis_cache or self._default_profile()
 
-        # 語尾パターンの上位を抽出
-        top_endings = [f"「{e[0]}」({e[2]}%)" for e in p.get("endings", [])[:5]]
-        endings_str = "、".join(top_endings) if top_endings else "「だ」「である」調"
-
-        # 文字比率
+        # 整形に使う値だけをハッシュ可能なタプルに取り出し、整形結果はキャッシュから引く
+        endings = tuple((e[0], e[2]) for e in p.get("endings", [])[:5])
         ratios = p.get("char_ratios", {})
-        kanji_pct = ratios.get("kanji_pct", 35)
-        hiragana_pct = ratios.get("hiragana_pct", 45)
-
-        # 口癖
-        phrases = p.get("frequent_phrases", [])
-        phrase_examples = "、".join([f"「{ph[0]}」" for ph in phrases[:5]]) if phrases else "なし"
-
-        # トーン
+        phrases = tuple(ph[0] for ph in p.get("frequent_phrases", [])[:5])
         tone = p.get("tone_markers", {})
         dominant_tone = max(tone, key=tone.get) if tone else "reflective"
-        tone_desc = {
-            "assertive": "断定的で力強い",
-            "questioning": "問いかけ型で読者に考えさせる",
-            "reflective": "内省的で落ち着いた",
-            "instructive": "教訓的でアドバイス寄り",
-        }.get(dominant_tone, "バランスの取れた")
-
-        return f"""【文体ルール】
-- 語尾パターン: {endings_str}
-- 漢字率約{kanji_pct}%、ひらがな率約{hiragana_pct}%のバランスを保つ
-- 口調は{tone_desc}トーン
-- 頻出フレーズ: {phrase_examples}
-- 平均文字数: {p.get('avg_length', 100)}文字前後"""
+
+        return _format_style_fragment(
+            endings,
+            ratios.get("kanji_pct", 35),
+            ratios.get("hiragana_pct", 45),
+            dominant_tone,
+            phrases,
+            p.get("avg_length", 100),
+        )
 
     def save_profile(self, profile: dict, filename: str = "style_profile.json"):
         """スタイルプロファイルを保存"""
@@ -2,9 +2,13 @@
 テスト - コンテンツエンジンとバリデーションのテスト
 """
 
+import asyncio
+import json
 import pytest
 import sys
 import os
+from contextlib import nullcontext
+from types import SimpleNamespace
 
 # プロジェクトルートをパスに追加
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
@@ -12,6 +16,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from src.content_engine import ContentEngine, BANNED_EXPRESSIONS
 from src.style_analyzer import StyleAnalyzer
 from src.scheduler import PostScheduler, PEAK_SLOTS
+from src import storage
+from src.api_handler import XAPIClient
+from src.reply_handler import ReplyHandler
+from src.engagement_handler import EngagementHandler, RateLimiter, QUOTED_IDS_LIMIT
+from src.research import ResearchModule
 
 
 class TestContentValidation:
@@ -81,6 +90,27 @@ class TestContentValidation:
             valid, issue = engine.validate_tweet(text)
             assert valid is False, f"禁止表現「{expr}」が検出されませんでした"
 
+    def test_banned_expression_reported(self):
+        """十分な長さのテキストでも禁止表現を検出し、該当表現を報告する"""
+        engine = self._make_engine()
+        text = "AIツールを正しく使えば絶対に儲かるという話は聞き飽きた。大切なのは道具の性能ではなく、正しい問いを立てる力と、毎日積み上げる行動の量である。"
+        valid, issue = engine.validate_tweet(text)
+        assert valid is False
+        assert "絶対に儲かる" in issue
+
+    def test_banned_expression_regex_fallback(self, monkeypatch):
+        """pyahocorasick がない環境でも同じように禁止表現を検出する"""
+        from src import content_engine
+        monkeypatch.setattr(content_engine, "_BANNED_AUTOMATON", None)
+        self.test_banned_expression_reported()
+
+    def test_length_checked_first(self):
+        """文字数が不合格なら、ハッシュタグ等があっても文字数の問題として即座に返す"""
+        engine = self._make_engine()
+        valid, issue = engine.validate_tweet("#AI " + "あ" * 140)
+        assert valid is False
+        assert "文字数超過" in issue
+
     def test_url_rejected(self):
         """URLの検出"""
         engine = self._make_engine()
@@ -110,6 +140,20 @@ class TestStyleAnalyzer:
         assert profile["total_tweets_analyzed"] == 0
         assert "note" in profile
 
+    def test_default_profile_shared_but_copied_for_callers(self):
+        """デフォルトプロファイルは共有の読み取り専用定数で、呼び出し側には複製を返す"""
+        analyzer = StyleAnalyzer()
+        assert analyzer._default_profile() is analyzer._default_profile()
+        with pytest.raises(TypeError):
+            analyzer._default_profile()["avg_length"] = 0
+
+        profile = analyzer.analyze_tweets([])
+        profile["endings"].clear()
+        profile["char_ratios"]["kanji_pct"] = 0
+        json.dumps(profile)  # save_profile でそのまま保存できる
+        assert len(analyzer.analyze_tweets([])["endings"]) == 5
+        assert analyzer._default_profile()["char_ratios"]["kanji_pct"] == 40.0
+
     def test_analyze_basic(self):
         """基本的なスタイル分析"""
         analyzer = StyleAnalyzer()
@@ -139,6 +183,119 @@ class TestStyleAnalyzer:
         assert "文体ルール" in fragment
         assert "語尾パターン" in fragment
 
+    def test_style_prompt_fragment_cached(self):
+        """同じ内容のプロファイルは整形済みテキストをキャッシュから返す"""
+        from src.style_analyzer import _format_style_fragment
+
+        analyzer = StyleAnalyzer()
+        profile = analyzer.analyze_tweets([{"text": "時間は資産である。"}, {"text": "行動すべきだ"}])
+        _format_style_fragment.cache_clear()
+        first = analyzer.get_style_prompt_fragment(profile)
+        second = analyzer.get_style_prompt_fragment(dict(profile))
+        assert first == second
+        assert "「である」" in first
+        assert _format_style_fragment.cache_info().hits == 1
+
+    def test_length_distribution_buckets(self):
+        """区間の境界（70・100・140）を含めて件数を数える"""
+        texts = ["あ" * n for n in (10, 69, 70, 99, 100, 140, 141)]
+        dist = StyleAnalyzer()._analyze_length_distribution(texts)
+        assert dist == {
+            "min": 10, "max": 141, "avg": 89.9,
+            "under_70": 2, "70_to_100": 2, "100_to_140": 2,
+        }
+
+    def test_phrases_ignore_urls_and_mentions(self):
+        """URL・メンションは口癖の集計から除く"""
+        texts = ["積み上げが大事 https://example.com @someone"] * 3 + ["今日も積み上げ"]
+        phrases = dict(StyleAnalyzer()._analyze_phrases(texts))
+        assert phrases["積み上げ"] == 4
+        assert not any("http" in p or "some" in p for p in phrases)
+
+    def test_phrases_tie_order_follows_first_occurrence(self):
+        """同数のフレーズは初出順（ツイート、長さ、位置の順）に並ぶ"""
+        texts = ["xyz", "ab", "abc", "ab", "xyz", "abc", "xyz"]
+        phrases = StyleAnalyzer()._analyze_phrases(texts)
+        assert phrases == [("ab", 4), ("xy", 3), ("yz", 3), ("xyz", 3)]
+
+    def test_tone_markers(self, monkeypatch):
+        """重なる判定語（すべき/べき）も両方のカテゴリに数える（オートマトンなしでも同じ）"""
+        from src import style_analyzer
+
+        texts = ["毎日学ぶべきだ", "行動すべきだと思う？", "静かな話"]
+        expected = {"assertive": 66.7, "questioning": 33.3, "reflective": 33.3, "instructive": 33.3}
+        assert StyleAnalyzer()._analyze_tone(texts) == expected
+        monkeypatch.setattr(style_analyzer, "_TONE_AUTOMATON", None)
+        assert StyleAnalyzer()._analyze_tone(texts) == expected
+
+
+class TestResearch:
+    """バズ投稿分析のテスト（API呼出なし）"""
+
+    def test_detect_pattern(self):
+        """構造パターンの判定と優先順位"""
+        research = ResearchModule(api_client=None)
+        assert research._detect_pattern("AIに仕事を奪われるのは誰か？") == "問いかけ型"
+        assert research._detect_pattern("しかし、行動するべきだ。") == "断言型"
+        assert research._detect_pattern("しかし、行動するべきだ") == "対比型"
+        assert research._detect_pattern("実際に使うと・速い・安い") == "リスト型"
+        assert research._detect_pattern("私は毎朝AIと話している") == "体験型"
+        assert research._detect_pattern("時間は資産である。") == "格言型"
+        assert research._detect_pattern("AIと共に生きる") == "その他"
+
+    def test_detect_pattern_overlapping_markers(self):
+        """重なったマーカー語（しかし＋しかない など）もそれぞれ検出する"""
+        research = ResearchModule(api_client=None)
+        assert research._detect_pattern("これはやるしかしかない。") == "断言型"
+        assert research._detect_pattern("でもしかない") == "対比型"
+        assert research._detect_pattern("私はしかしかない") == "対比型"
+
+    def test_research_genre_keeps_keyword_order(self):
+        """並列検索でもキーワード順に結果をまとめ、重複とバズ未満を除外する"""
+        from src.research import RESEARCH_GENRES, BUZZ_THRESHOLD_LIKES
+
+        genre = "AIトレンド"
+        keywords = RESEARCH_GENRES[genre]
+
+        def search_tweets(query, max_results=20):
+            k = next(i for i, kw in enumerate(keywords) if query.startswith(kw))
+            return [
+                {"id": f"{k}", "like_count": BUZZ_THRESHOLD_LIKES},
+                {"id": "dup", "like_count": BUZZ_THRESHOLD_LIKES},
+                {"id": f"low{k}", "like_count": 0},
+            ]
+
+        module = ResearchModule(api_client=SimpleNamespace(search_tweets=search_tweets))
+        results = module.research_genre(genre)
+        assert [t["id"] for t in results] == ["0", "dup", "1", "2", "3", "4"]
+        assert all(t["genre"] == genre for t in results)
+
+    def test_research_all_genres_caps_concurrency(self):
+        """全ジャンルの検索を1つのプールで流し、同時実行数を上限内に抑える"""
+        import threading
+        import time
+        from src.research import RESEARCH_GENRES, BUZZ_THRESHOLD_LIKES, SEARCH_MAX_WORKERS
+
+        lock = threading.Lock()
+        active = peak = 0
+
+        def search_tweets(query, max_results=20):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.01)
+            with lock:
+                active -= 1
+            return [{"id": query.split(" lang:")[0], "like_count": BUZZ_THRESHOLD_LIKES}]
+
+        module = ResearchModule(api_client=SimpleNamespace(search_tweets=search_tweets))
+        results = module.research_all_genres()
+        assert peak <= SEARCH_MAX_WORKERS
+        assert [(t["genre"], t["id"]) for t in results] == [
+            (genre, kw) for genre, keywords in RESEARCH_GENRES.items() for kw in keywords
+        ]
+
 
 class TestScheduler:
     """スケジューラーのテスト"""
@@ -149,9 +306,9 @@ class TestScheduler:
 
     def test_period_distribution(self):
         """朝3件・昼3件・夜4件の分布"""
-        morning = sum(1 for s in PEAK_SLOTS if s["period"] == "morning")
-        noon = sum(1 for s in PEAK_SLOTS if s["period"] == "noon")
-        evening = sum(1 for s in PEAK_SLOTS if s["period"] == "evening")
+        morning = sum(1 for s in PEAK_SLOTS if s.period == "morning")
+        noon = sum(1 for s in PEAK_SLOTS if s.period == "noon")
+        evening = sum(1 for s in PEAK_SLOTS if s.period == "evening")
         assert morning == 3
         assert noon == 3
         assert evening == 4
@@ -166,6 +323,235 @@ class TestScheduler:
         assert all("scheduled_time" in t for t in assigned)
         assert all("period" in t for t in assigned)
 
+    def test_edit_scheduled_saves_once(self, tmp_path):
+        """edit_scheduled はブロック終了時に保存し、例外時は保存しない"""
+        scheduler = PostScheduler()
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.stock_tweets(["テスト投稿1"])
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["テスト投稿2"]))
+            scheduler.assign_time_slots([d for d in data if d["status"] == "pending"])
+        saved = scheduler._load_scheduled()
+        assert [d["text"] for d in saved] == ["テスト投稿1", "テスト投稿2"]
+        assert all("scheduled_time" in d for d in saved)
+
+        with pytest.raises(RuntimeError):
+            with scheduler.edit_scheduled() as data:
+                data.clear()
+                raise RuntimeError("中断")
+        assert len(scheduler._load_scheduled()) == 2
+
+    def test_daemon_waits_until_next_due(self, tmp_path):
+        """デーモンは次の予約時刻まで（最大 DAEMON_POLL_SECONDS）待つ"""
+        from datetime import datetime, timedelta
+        from src.scheduler import DAEMON_POLL_SECONDS
+
+        scheduler = PostScheduler()
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        assert scheduler._seconds_until_next_due() == DAEMON_POLL_SECONDS
+
+        scheduler.stock_tweets(["テスト投稿"])
+        with scheduler.edit_scheduled() as data:
+            data[0]["scheduled_time"] = (datetime.now() + timedelta(seconds=10)).isoformat()
+        assert 0 < scheduler._seconds_until_next_due() <= 10
+        # 定期確認までの残り時間のほうが短ければそちらで待つ
+        assert scheduler._seconds_until_next_due(limit=3.5) == 3.5
+
+    def test_execute_scheduled_posts_due_items_in_time_order(self, tmp_path):
+        """時間が来た予約だけを予約時刻の早い順に投稿する"""
+        from datetime import datetime, timedelta
+
+        posted = []
+        api = SimpleNamespace(
+            post_tweet=lambda text: posted.append(text) or {"success": True, "tweet_id": "1"}
+        )
+        scheduler = PostScheduler(api_client=api)
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.history_file = str(tmp_path / "post_history.jsonl")
+        now = datetime.now()
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["遅い", "早い", "未来"]))
+            for item, minutes in zip(data, (-1, -5, 30)):
+                item["scheduled_time"] = (now + timedelta(minutes=minutes)).isoformat()
+
+        scheduler.execute_scheduled()
+        assert posted == ["早い", "遅い"]
+        statuses = [d["status"] for d in scheduler._load_scheduled()]
+        assert statuses == ["posted", "posted", "pending"]
+        with open(scheduler.history_file, encoding="utf-8") as f:
+            history = [json.loads(line) for line in f]
+        assert [h["text"] for h in history] == ["早い", "遅い"]
+
+    def test_load_scheduled_cached_until_file_changes(self, tmp_path, monkeypatch):
+        """ファイルが変わるまではパースし直さず、保存しない変更はキャッシュに残さない"""
+        from src import scheduler as scheduler_module
+
+        scheduler = PostScheduler()
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.stock_tweets(["一"])
+
+        calls = []
+        real_load_json = scheduler_module.load_json
+        monkeypatch.setattr(
+            scheduler_module, "load_json", lambda path: calls.append(path) or real_load_json(path)
+        )
+        assert [d["text"] for d in scheduler._load_scheduled()] == ["一"]
+        assert calls == []
+
+        with pytest.raises(RuntimeError):
+            with scheduler.edit_scheduled() as data:
+                data.append({"text": "保存されない", "status": "pending"})
+                raise RuntimeError
+        # 保存せずに書き換えても（assign_time_slots の結果を捨てた場合など）影響しない
+        scheduler.assign_time_slots(scheduler.get_pending_tweets())
+        loaded = scheduler._load_scheduled()
+        assert [d["text"] for d in loaded] == ["一"]
+        assert "scheduled_time" not in loaded[0]
+        assert calls == []
+
+        items = scheduler.make_stock_items(["外部"])
+        storage.save_json(scheduler.scheduled_file, items)
+        os.utime(scheduler.scheduled_file, ns=(1, 1))
+        assert [d["text"] for d in scheduler._load_scheduled()] == ["外部"]
+        assert len(calls) == 1
+
+    def test_status_does_not_parse_scheduled_times(self, tmp_path):
+        """状況表示などの読み取りだけの処理では予約時刻をパースしない"""
+        scheduler = PostScheduler()
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["壊れた予約"]))
+            data[0]["scheduled_time"] = "bogus"
+
+        assert "待機中: 1 件" in scheduler.get_schedule_summary()
+        assert [d["text"] for d in scheduler.get_pending_tweets()] == ["壊れた予約"]
+
+    def test_invalid_scheduled_time_marked_failed(self, tmp_path):
+        """予約時刻が不正な項目だけを failed にし、他の予約は通常どおり投稿する"""
+        from datetime import datetime, timedelta
+        from src.scheduler import DAEMON_POLL_SECONDS
+
+        posted = []
+        api = SimpleNamespace(
+            post_tweet=lambda text: posted.append(text) or {"success": True, "tweet_id": "1"}
+        )
+        scheduler = PostScheduler(api_client=api)
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.history_file = str(tmp_path / "post_history.jsonl")
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["壊れた予約", "正常"]))
+            data[0]["scheduled_time"] = "bogus"
+            data[1]["scheduled_time"] = (datetime.now() - timedelta(minutes=1)).isoformat()
+
+        assert scheduler._seconds_until_next_due() == 0.0
+        scheduler.execute_scheduled()
+        assert posted == ["正常"]
+        broken, ok = scheduler._load_scheduled()
+        assert broken["status"] == "failed"
+        assert "bogus" in broken["error"]
+        assert ok["status"] == "posted"
+        assert scheduler._seconds_until_next_due() == DAEMON_POLL_SECONDS
+
+    def test_idle_execute_scheduled_skips_write(self, tmp_path):
+        """時間が来た予約が無ければスケジュールファイルを書き直さない"""
+        from datetime import datetime, timedelta
+
+        scheduler = PostScheduler()
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.history_file = str(tmp_path / "post_history.jsonl")
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["未来"]))
+            data[0]["scheduled_time"] = (datetime.now() + timedelta(hours=1)).isoformat()
+        # 保存は一時ファイルとの置き換えなので、書き直されれば inode が変わる
+        before = os.stat(scheduler.scheduled_file).st_ino
+
+        assert scheduler.execute_scheduled() == []
+        assert os.stat(scheduler.scheduled_file).st_ino == before
+        assert not os.path.exists(scheduler.history_file)
+
+    def test_execute_scheduled_async_posts_concurrently(self, tmp_path):
+        """非同期版は予約時刻が同じ予約を並行して投稿し、例外は失敗として記録する"""
+        import threading
+        from datetime import datetime, timedelta
+
+        # 2件が同時に投稿中にならないと Barrier を抜けられない
+        barrier = threading.Barrier(2, timeout=5)
+
+        def post_tweet(text):
+            if text == "長すぎる":
+                raise ValueError("ツイートが140文字を超えています")
+            barrier.wait()
+            return {"success": True, "tweet_id": text}
+
+        scheduler = PostScheduler(api_client=SimpleNamespace(post_tweet=post_tweet))
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.history_file = str(tmp_path / "post_history.jsonl")
+        past = (datetime.now() - timedelta(minutes=1)).isoformat()
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["一", "二", "長すぎる"]))
+            for item in data:
+                item["scheduled_time"] = past
+
+        results = asyncio.run(scheduler.execute_scheduled_async())
+        assert len(results) == 3
+        by_text = {d["text"]: d for d in scheduler._load_scheduled()}
+        assert by_text["一"]["tweet_id"] == "一"
+        assert by_text["二"]["status"] == "posted"
+        assert by_text["長すぎる"]["status"] == "failed"
+
+    def test_execute_scheduled_async_keeps_time_order(self, tmp_path):
+        """予約時刻が違う投稿は、先の投稿が遅くても予約時刻の早い順に投稿する"""
+        import time
+        from datetime import datetime, timedelta
+
+        posted = []
+
+        def post_tweet(text):
+            if text == "早い":
+                time.sleep(0.05)
+            posted.append(text)
+            return {"success": True, "tweet_id": text}
+
+        scheduler = PostScheduler(api_client=SimpleNamespace(post_tweet=post_tweet))
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        scheduler.history_file = str(tmp_path / "post_history.jsonl")
+        now = datetime.now()
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["遅い", "早い"]))
+            for item, minutes in zip(data, (-1, -5)):
+                item["scheduled_time"] = (now + timedelta(minutes=minutes)).isoformat()
+
+        asyncio.run(scheduler.execute_scheduled_async())
+        assert posted == ["早い", "遅い"]
+
+    def test_history_migrated_and_appended(self, tmp_path):
+        """旧形式の履歴は JSON Lines に移行し、以降は追記だけ行う"""
+        scheduler = PostScheduler()
+        scheduler.history_file = str(tmp_path / "post_history.jsonl")
+        legacy = [{"text": "旧履歴", "timestamp": "2026-01-01T00:00:00", "result": "dry_run"}]
+        storage.save_json(tmp_path / "post_history.json", legacy)
+
+        scheduler._update_history([{"text": "新しい投稿", "result": "dry_run"}])
+        scheduler._update_history([])
+        assert not (tmp_path / "post_history.json").exists()
+        with open(scheduler.history_file, encoding="utf-8") as f:
+            history = [json.loads(line) for line in f]
+        assert [h["text"] for h in history] == ["旧履歴", "新しい投稿"]
+
+    def test_schedule_summary_counts(self, tmp_path):
+        """ステータスごとの件数と次の予約を要約する"""
+        scheduler = PostScheduler()
+        scheduler.scheduled_file = str(tmp_path / "scheduled.json")
+        with scheduler.edit_scheduled() as data:
+            data.extend(scheduler.make_stock_items(["投稿済み", "待機A", "失敗", "待機B"]))
+            data[0]["status"] = "posted"
+            data[2]["status"] = "failed"
+        summary = scheduler.get_schedule_summary()
+        assert "待機中: 2 件" in summary and "投稿済: 1 件" in summary
+        assert "失敗:   1 件" in summary and "合計:   4 件" in summary
+        assert "待機A" in summary and "投稿済み" not in summary.split("次の予約投稿")[1]
+        assert [t["text"] for t in scheduler.get_pending_tweets(count=1)] == ["待機A"]
+
 
 class TestCleanOutput:
     """出力クリーニングのテスト"""
@@ -187,6 +573,12 @@ class TestCleanOutput:
         assert engine._clean_output("1. テスト投稿") == "テスト投稿"
         assert engine._clean_output("2) テスト投稿") == "テスト投稿"
 
+    def test_remove_combined_decorations(self):
+        """引用符・太字・番号が重なっていても一度に除去する"""
+        engine = self._make_engine()
+        assert engine._clean_output("「**1. テスト投稿**」") == "テスト投稿"
+        assert engine._clean_output('"テスト「投稿」です"') == "テスト「投稿」です"
+
     def test_multiline_takes_first(self):
         """複数行の場合は最初の行のみ"""
         engine = self._make_engine()
@@ -194,5 +586,428 @@ class TestCleanOutput:
         assert result == "一行目"
 
 
+class TestStorage:
+    """JSON読み書きユーティリティのテスト"""
+
+    DATA = [{"text": "日本語の投稿", "status": "pending", "posted_at": None}]
+
+    def test_round_trip(self, tmp_path):
+        """保存した内容をそのまま読み込めること"""
+        path = str(tmp_path / "data.json")
+        storage.save_json(path, self.DATA)
+        assert storage.load_json(path) == self.DATA
+
+    def test_stdlib_fallback_matches(self, tmp_path, monkeypatch):
+        """orjson なしでも同じバイト列を出力すること"""
+        fast_path = str(tmp_path / "fast.json")
+        storage.save_json(fast_path, self.DATA)
+        monkeypatch.setattr(storage, "orjson", None)
+        slow_path = str(tmp_path / "slow.json")
+        storage.save_json(slow_path, self.DATA)
+        assert open(fast_path, "rb").read() == open(slow_path, "rb").read()
+        assert storage.load_json(slow_path) == self.DATA
+
+    def test_compact_output(self, tmp_path, monkeypatch):
+        """pretty=False では改行・空白なしで出力すること"""
+        fast_path = str(tmp_path / "fast.json")
+        storage.save_json(fast_path, self.DATA, pretty=False)
+        monkeypatch.setattr(storage, "orjson", None)
+        slow_path = str(tmp_path / "slow.json")
+        storage.save_json(slow_path, self.DATA, pretty=False)
+        raw = open(fast_path, "rb").read()
+        assert raw == open(slow_path, "rb").read()
+        assert b"\n" not in raw and b": " not in raw
+
+    def test_large_file_read_via_mmap(self, tmp_path, monkeypatch):
+        """MMAP_THRESHOLD 以上のファイルも同じ内容で読み込めること"""
+        if storage.orjson is None:
+            pytest.skip("orjson が必要")
+        path = str(tmp_path / "large.json")
+        storage.save_json(path, self.DATA)
+        monkeypatch.setattr(storage, "MMAP_THRESHOLD", 1)
+        assert storage.load_json(path) == self.DATA
+
+
+class TestUserIdCache:
+    """ユーザーIDディスクキャッシュのテスト（API呼出なし）"""
+
+    def _make_client(self, cache_file, lookups):
+        client = XAPIClient.__new__(XAPIClient)
+        client.username = "tester"
+        client.user_id_cache_file = cache_file
+
+        def get_user(username):
+            lookups.append(username)
+            return SimpleNamespace(data=SimpleNamespace(id=12345))
+
+        client.client = SimpleNamespace(get_user=get_user)
+        client._user_id = client._load_cached_user_id()
+        return client
+
+    def test_user_id_cached_across_instances(self, tmp_path):
+        """一度解決したユーザーIDは次回起動時にAPIを呼ばずに使われる"""
+        cache_file = str(tmp_path / "user_id.cache.json")
+        lookups = []
+        assert self._make_client(cache_file, lookups).user_id == "12345"
+        assert self._make_client(cache_file, lookups).user_id == "12345"
+        assert lookups == ["tester"]
+
+
+class TestReplyHandler:
+    """自動返信のテスト（API呼出なし）"""
+
+    def test_replies_generated_concurrently_and_posted_in_order(self, tmp_path):
+        """返信は並列生成し、投稿は古い順に行い、失敗分はスキップする"""
+        posted = []
+
+        class FakeEngine:
+            async_session = staticmethod(nullcontext)
+
+            async def agenerate_reply(self, mention_text, author_username):
+                if mention_text == "失敗":
+                    raise ValueError("生成失敗")
+                return f"@{author_username} 返信"
+
+        def post_tweet(text, reply_to_id=None):
+            posted.append(reply_to_id)
+            return {"success": True, "tweet_id": f"r{reply_to_id}", "text": text}
+
+        mentions = [  # API は新しい順に返す
+            {"id": "3", "text": "三件目", "author_username": "c"},
+            {"id": "2", "text": "失敗", "author_username": "b"},
+            {"id": "1", "text": "一件目", "author_username": "a"},
+        ]
+        api = SimpleNamespace(get_mentions=lambda since_id=None: mentions, post_tweet=post_tweet)
+        handler = ReplyHandler(api_client=api, content_engine=FakeEngine())
+        handler.state_file = str(tmp_path / "reply_state.json")
+        handler.run()
+        assert posted == ["1", "3"]
+        assert handler._load_state()["last_mention_id"] == "3"
+
+    def test_state_saved_once_per_run(self, tmp_path, monkeypatch):
+        """状態ファイルはメンションの件数に関わらず1回だけ書き込む"""
+        saves = []
+
+        class FakeEngine:
+            async_session = staticmethod(nullcontext)
+
+            async def agenerate_reply(self, mention_text, author_username):
+                return f"@{author_username} 返信"
+
+        mentions = [{"id": str(i), "text": "本文", "author_username": "a"} for i in range(5, 0, -1)]
+        api = SimpleNamespace(
+            get_mentions=lambda since_id=None: mentions,
+            post_tweet=lambda text, reply_to_id=None: {"success": True, "tweet_id": "r", "text": text},
+        )
+        handler = ReplyHandler(api_client=api, content_engine=FakeEngine())
+        handler.state_file = str(tmp_path / "reply_state.json")
+        monkeypatch.setattr(handler, "_save_state", lambda state: saves.append(dict(state)))
+        handler.run()
+        assert len(saves) == 1
+        assert saves[0]["last_mention_id"] == "5"
+
+    def test_load_state_cached_until_file_changes(self, tmp_path, monkeypatch):
+        """状態はキャッシュから返し、外部で更新されたときだけ読み直す"""
+        from src import reply_handler
+
+        handler = ReplyHandler(api_client=None, content_engine=None)
+        handler.state_file = str(tmp_path / "reply_state.json")
+        assert handler._load_state() == {"last_mention_id": None}
+
+        handler._save_state({"last_mention_id": "1"})
+        loads = []
+        real_load_json = reply_handler.load_json
+        monkeypatch.setattr(
+            reply_handler, "load_json", lambda path: loads.append(path) or real_load_json(path)
+        )
+        first = handler._load_state()
+        assert first == {"last_mention_id": "1"}
+        assert loads == []
+
+        # 保存せずに変更しても、次の読み込みには影響しない
+        first["last_mention_id"] = "未保存"
+        assert handler._load_state() == {"last_mention_id": "1"}
+
+        storage.save_json(handler.state_file, {"last_mention_id": "2"})
+        os.utime(handler.state_file, ns=(handler._state_mtime + 10**9,) * 2)
+        assert handler._load_state() == {"last_mention_id": "2"}
+
+
+class TestEngagementHandler:
+    """引用RTのテスト（API呼出なし）"""
+
+    def test_quote_skips_quoted_and_keeps_recent_ids(self, tmp_path):
+        """引用済みのIDは選ばず、保存するIDは直近 QUOTED_IDS_LIMIT 件に保つ"""
+        quoted = []
+        api = SimpleNamespace(
+            user_id="me",
+            search_tweets=lambda query, max_results=10: [
+                {"id": "old1", "text": "引用済み", "author_id": "x"},
+                {"id": "new", "text": "未引用", "author_id": "x"},
+            ],
+            quote_tweet=lambda text, quote_tweet_id: (
+                quoted.append(quote_tweet_id) or {"success": True, "tweet_id": "q"}
+            ),
+        )
+        engine = SimpleNamespace(generate_quote_comment=lambda text: "コメント")
+        handler = EngagementHandler(api_client=api, content_engine=engine)
+        handler.state_file = str(tmp_path / "engagement_state.json")
+        old_ids = [f"old{i}" for i in range(QUOTED_IDS_LIMIT)]
+        handler._save_state({"quoted_tweet_ids": old_ids, "last_quote_time": None})
+
+        handler.run_quote_retweet()
+        assert quoted == ["new"]
+        saved = storage.load_json(handler.state_file)["quoted_tweet_ids"]
+        assert saved == old_ids[1:] + ["new"]
+
+    def test_unsaved_state_changes_not_cached(self, tmp_path, monkeypatch):
+        """読み込んだ状態を保存せずに変更しても、保存に失敗しても、キャッシュは変わらない"""
+        from src import engagement_handler
+
+        handler = EngagementHandler(api_client=None)
+        handler.state_file = str(tmp_path / "engagement_state.json")
+        handler._save_state({"quoted_tweet_ids": ["1"], "last_quote_time": None})
+
+        state = handler._load_state()
+        state["quoted_tweet_ids"].append("未保存")
+        state["last_quote_time"] = "2026-01-01T00:00:00"
+        assert handler._load_state() == {"quoted_tweet_ids": ["1"], "last_quote_time": None}
+
+        def failing_save_json(path, data):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(engagement_handler, "save_json", failing_save_json)
+        with pytest.raises(OSError):
+            handler._save_state(state)
+        assert handler._load_state() == {"quoted_tweet_ids": ["1"], "last_quote_time": None}
+
+    def test_rate_limiter_bursts_then_waits(self, monkeypatch):
+        """容量分は待たずに通し、使い切った後は補充分だけ待つ"""
+        from src import engagement_handler
+
+        clock = [0.0]
+        sleeps = []
+
+        def fake_sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        monkeypatch.setattr(engagement_handler.time, "monotonic", lambda: clock[0])
+        monkeypatch.setattr(engagement_handler.time, "sleep", fake_sleep)
+        limiter = RateLimiter(rate_per_sec=2.0, capacity=3)
+        for _ in range(5):
+            limiter.acquire()
+        assert sleeps == [0.5, 0.5]
+
+
+class _FakeStream:
+    """messages.stream のコンテキストマネージャを模したスタブ（数文字ずつ返す）"""
+
+    def __init__(self, text, chunk_size=10):
+        self.chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        self.consumed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def _iter(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+    @property
+    def text_stream(self):
+        return self._iter()
+
+
+class _FakeAsyncStream(_FakeStream):
+    @property
+    def text_stream(self):
+        async def aiter():
+            for chunk in self._iter():
+                yield chunk
+        return aiter()
+
+
+class _FakeMessages:
+    """messages.create / messages.stream の呼び出しを記録し、用意した出力を順に返すスタブ"""
+
+    stream_class = _FakeStream
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+        self.calls = []
+        self.streams = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(content=[SimpleNamespace(text=self.outputs.pop(0))])
+
+    def stream(self, **kwargs):
+        self.calls.append(kwargs)
+        stream = self.stream_class(self.outputs.pop(0))
+        self.streams.append(stream)
+        return stream
+
+
+class _FakeAsyncMessages(_FakeMessages):
+    """AsyncAnthropic の messages.create / messages.stream を模したスタブ"""
+
+    stream_class = _FakeAsyncStream
+
+    async def create(self, **kwargs):
+        return _FakeMessages.create(self, **kwargs)
+
+
+class TestBatchGeneration:
+    """一括生成のテスト（API呼出なし）"""
+
+    VALID = "AIを使いこなす人と使われる人の差は、最初の一歩を踏み出したかどうかだけだ。道具は誰にでも開かれている。差がつくのは触り続けた時間である。"
+
+    def _make_engine(self, outputs):
+        engine = ContentEngine.__new__(ContentEngine)
+        engine.style_prompt = ""
+        engine.model = "test-model"
+        engine.client = SimpleNamespace(messages=_FakeMessages(outputs))
+        return engine
+
+    def test_parse_batch_output_with_code_fence(self):
+        """コードブロック付きJSONを index 順に展開"""
+        engine = self._make_engine([])
+        raw = "```json\n" + json.dumps(
+            [{"index": 2, "text": "二件目"}, {"index": 1, "text": "一件目"}],
+            ensure_ascii=False,
+        ) + "\n```"
+        assert engine._parse_batch_output(raw, 3) == ["一件目", "二件目", None]
+
+    def test_parse_batch_output_invalid_json(self):
+        """JSONでない出力は全件 None"""
+        engine = self._make_engine([])
+        assert engine._parse_batch_output("1. 投稿です", 2) == [None, None]
+
+    def test_batch_single_request(self):
+        """全件が条件を満たせば1回のリクエストで完了"""
+        batch = json.dumps(
+            [{"index": 1, "text": self.VALID}, {"index": 2, "text": self.VALID}],
+            ensure_ascii=False,
+        )
+        engine = self._make_engine([batch])
+        tweets = engine._generate_batch_from_themes(["テーマA", "テーマB"], None)
+        assert tweets == [self.VALID, self.VALID]
+        assert len(engine.client.messages.calls) == 1
+        assert "テーマA" in engine.client.messages.calls[0]["messages"][0]["content"]
+        # 全リクエストで同じシステムブロックを共有
+        system = engine.client.messages.calls[0]["system"]
+        assert system is engine._system_blocks
+
+    def test_batch_fix_round(self):
+        """失敗した項目だけを理由付きの1回の修正依頼で作り直す"""
+        batch = json.dumps(
+            [{"index": 1, "text": self.VALID}, {"index": 2, "text": "短すぎる"}],
+            ensure_ascii=False,
+        )
+        fixed = json.dumps([{"index": 2, "text": self.VALID}], ensure_ascii=False)
+        engine = self._make_engine([batch, fixed])
+        tweets = engine._generate_batch_from_themes(["テーマA", "テーマB"], None)
+        assert tweets == [self.VALID, self.VALID]
+        calls = engine.client.messages.calls
+        assert len(calls) == 2
+        fix_prompt = calls[1]["messages"][0]["content"]
+        assert "文字数不足" in fix_prompt and "テーマB" in fix_prompt
+        assert "テーマA" not in fix_prompt
+
+    def test_batch_falls_back_to_individual(self):
+        """一括リクエストが2回とも使えない場合のみ個別に再生成"""
+        engine = self._make_engine(["解析できない出力", "解析できない出力", self.VALID, self.VALID])
+        tweets = engine._generate_batch_from_themes(["テーマA", "テーマB"], None)
+        assert tweets == [self.VALID, self.VALID]
+        assert len(engine.client.messages.calls) == 4
+
+    def test_thoughts_batch_uses_json_request(self):
+        """思考メモからの一括生成も同じJSON形式の1リクエストで受け取る"""
+        batch = json.dumps(
+            [{"index": i, "text": self.VALID} for i in range(1, 4)], ensure_ascii=False
+        )
+        engine = self._make_engine([batch])
+        tweets = engine.generate_batch(count=3, user_thoughts="AIと仕事の関係についてのメモ")
+        assert tweets == [self.VALID] * 3
+        (call,) = engine.client.messages.calls
+        assert call["max_tokens"] == 900
+        assert "AIと仕事の関係についてのメモ" in call["messages"][0]["content"]
+
+    def test_thoughts_batch_refills_shortfall(self):
+        """一括生成で足りなかった件数だけ個別生成で補う"""
+        batch = json.dumps(
+            [{"index": 1, "text": self.VALID}, {"index": 2, "text": "短すぎる"}],
+            ensure_ascii=False,
+        )
+        engine = self._make_engine([batch, self.VALID, self.VALID])
+        tweets = engine.generate_batch(count=3, user_thoughts="メモ")
+        assert tweets == [self.VALID] * 3
+        assert len(engine.client.messages.calls) == 3
+
+    def test_stream_aborted_when_too_long(self):
+        """ストリーミング中に長すぎると分かった時点で打ち切ってリトライする"""
+        engine = self._make_engine(["あ" * 400, self.VALID])
+        assert engine.generate_tweet(theme="テーマA") == self.VALID
+        first = engine.client.messages.streams[0]
+        assert first.consumed < len(first.chunks)
+        assert "文字数超過" in engine.client.messages.calls[1]["messages"][0]["content"]
+
+    def test_system_prompt_rebuilt_on_style_change(self):
+        """style_prompt を変更した時だけシステムプロンプトが再構築される"""
+        engine = self._make_engine([])
+        blocks = engine._system_blocks
+        engine.style_prompt = "【文体ルール】テスト"
+        assert engine._system_blocks is not blocks
+        # 固定部分は共通、スタイル指示はその後ろの別ブロック
+        static, style = engine._system_blocks
+        assert static == blocks[0]
+        assert style == {"type": "text", "text": "【文体ルール】テスト"}
+
+    def test_async_client_per_event_loop(self, monkeypatch):
+        """非同期クライアントは asyncio.run ごとに作り、終わったら閉じる"""
+        import anthropic
+
+        created = []
+        valid = self.VALID
+
+        class FakeAsyncAnthropic:
+            def __init__(self, api_key):
+                self.messages = _FakeAsyncMessages([valid] * 2)
+                self.closed = False
+                created.append(self)
+
+            async def close(self):
+                self.closed = True
+
+        monkeypatch.setattr(anthropic, "AsyncAnthropic", FakeAsyncAnthropic)
+        engine = self._make_engine([])
+        engine._api_key = "test"
+        engine.aclient = None
+        for _ in range(2):
+            assert asyncio.run(engine.agenerate_batch(count=2)) == [self.VALID] * 2
+        assert len(created) == 2
+        assert all(c.closed for c in created)
+        assert engine.aclient is None
+
+    def test_agenerate_batch(self):
+        """非同期版はテーマごとに1リクエストずつ並列に生成する"""
+        engine = self._make_engine([])
+        engine.aclient = SimpleNamespace(messages=_FakeAsyncMessages([self.VALID] * 3))
+        tweets = asyncio.run(engine.agenerate_batch(count=3, max_concurrent=2))
+        assert tweets == [self.VALID] * 3
+        assert len(engine.aclient.messages.calls) == 3
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])